@@ -0,0 +1,201 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from receipts import remove_receipt
+
+JOURNAL_PATH = os.environ.get("CHALLAN_JOURNAL_PATH", os.path.join(".challan_data", "journal.sqlite3"))
+RESUME_LIST_LIMIT = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    operator TEXT NOT NULL,
+    challan_type TEXT NOT NULL,
+    start_no INTEGER NOT NULL,
+    pdate TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'open',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS batches_operator ON batches (operator, status, updated_at);
+CREATE TABLE IF NOT EXISTS batch_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL REFERENCES batches (batch_id),
+    kind TEXT NOT NULL,
+    receipt_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS batch_events_batch ON batch_events (batch_id, seq);
+"""
+
+INSERT_EVENT = "INSERT INTO batch_events (batch_id, kind, receipt_id, payload, created_at) VALUES (?, ?, ?, ?, ?)"
+TOUCH_BATCH = "UPDATE batches SET status = ?, updated_at = ? WHERE batch_id = ?"
+
+
+def connect(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only syncs at checkpoints; a committed event survives an
+    # app crash, only a power loss can drop the last few.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class BatchJournal:
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.last_error = ""
+        self._conn = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    # --- WRITES ---
+    # Receipt events go through one writer thread, which commits everything
+    # queued since its last commit in a single transaction.
+    def _enqueue(self, batch_id, kind, receipt_id, payload, status="open"):
+        if not batch_id:
+            return
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                    self._writer.start()
+        self._queue.put((batch_id, kind, receipt_id, json.dumps(payload), status, time.time()))
+
+    def _write_loop(self):
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    conn = self._connection()
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        for batch_id, kind, receipt_id, payload, status, at in items:
+                            if kind:
+                                conn.execute(INSERT_EVENT, (batch_id, kind, receipt_id, payload, at))
+                            conn.execute(TOUCH_BATCH, (status, at, batch_id))
+                        conn.execute("COMMIT")
+                    except BaseException:
+                        conn.execute("ROLLBACK")
+                        raise
+            except (OSError, sqlite3.Error) as exc:
+                self.last_error = str(exc)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def flush(self):
+        self._queue.join()
+
+    def open_batch(self, batch_id, operator, challan_type, start_no, pdate):
+        # Returns False when the journal can't be written; the batch then
+        # simply isn't journaled.
+        now = time.time()
+        try:
+            with self._lock:
+                self._connection().execute(
+                    "INSERT INTO batches (batch_id, operator, challan_type, start_no, pdate, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (batch_id, operator, challan_type, start_no, pdate, now, now),
+                )
+        except (OSError, sqlite3.Error) as exc:
+            self.last_error = str(exc)
+            return False
+        return True
+
+    def record_add(self, batch_id, receipt):
+        self._enqueue(batch_id, "add", receipt["id"], receipt)
+
+    def record_edit(self, batch_id, receipt_id, changes):
+        self._enqueue(batch_id, "edit", receipt_id, changes)
+
+    def record_delete(self, batch_id, receipt_id):
+        self._enqueue(batch_id, "delete", receipt_id, {})
+
+    def set_status(self, batch_id, status):
+        self._enqueue(batch_id, "", "", {}, status)
+
+    # --- READS ---
+    def load_batch(self, batch_id):
+        self.flush()
+        try:
+            with self._lock:
+                conn = self._connection()
+                batch = conn.execute(
+                    "SELECT operator, challan_type, start_no, pdate, status FROM batches WHERE batch_id = ?",
+                    (batch_id,),
+                ).fetchone()
+                if batch is None:
+                    return None
+                events = conn.execute(
+                    "SELECT kind, receipt_id, payload FROM batch_events WHERE batch_id = ? ORDER BY seq",
+                    (batch_id,),
+                ).fetchall()
+        except (OSError, sqlite3.Error) as exc:
+            self.last_error = str(exc)
+            return None
+
+        receipts = []
+        by_id = {}
+        for kind, receipt_id, payload in events:
+            if kind == "add":
+                receipt = json.loads(payload)
+                receipts.append(receipt)
+                by_id[receipt_id] = receipt
+            elif kind == "edit" and receipt_id in by_id:
+                by_id[receipt_id].update(json.loads(payload))
+            elif kind == "delete" and by_id.pop(receipt_id, None) is not None:
+                remove_receipt(receipts, receipt_id)
+
+        operator, challan_type, start_no, pdate, status = batch
+        return {
+            "batch_id": batch_id,
+            "operator": operator,
+            "challan_type": challan_type,
+            "start_no": start_no,
+            "pdate": pdate,
+            "status": status,
+            "receipts": receipts,
+        }
+
+    def open_batches(self, operator, limit=RESUME_LIST_LIMIT):
+        self.flush()
+        try:
+            with self._lock:
+                rows = self._connection().execute(
+                    "SELECT b.batch_id, b.challan_type, b.start_no, b.pdate, b.updated_at, "
+                    "SUM(e.kind = 'add') - SUM(e.kind = 'delete') AS receipt_count "
+                    "FROM batches b JOIN batch_events e ON e.batch_id = b.batch_id "
+                    "WHERE b.operator = ? AND b.status != 'finalized' "
+                    "GROUP BY b.batch_id HAVING receipt_count > 0 "
+                    "ORDER BY b.updated_at DESC LIMIT ?",
+                    (operator, limit),
+                ).fetchall()
+        except (OSError, sqlite3.Error) as exc:
+            self.last_error = str(exc)
+            return []
+        keys = ("batch_id", "challan_type", "start_no", "pdate", "updated_at", "receipt_count")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+journal = BatchJournal()
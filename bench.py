@@ -0,0 +1,373 @@
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from importlib import metadata
+
+from catalog import CC_PURPOSE, MONTH_LIST, SD_ACCOUNT, SD_MSD_PURPOSE, SD_TAG
+from formatting import amount_words, clear_format_cache, format_indian_currency, format_period_month_text
+from master_data import MONTH_ABBR, MasterData, normalize_consumer_number, parse_bill_sheet
+from receipts import build_receipt, month_range, sd_msd_breakdown
+from rendering import clear_fragment_cache, prerender_fragments, render_docx
+from template_registry import CC_ADVANCE_TEMPLATE, SD_TEMPLATE, registry as templates
+
+DEFAULT_ROWS = [1000, 10000, 50000]
+DEFAULT_MONTHS = [12, 36]
+DEFAULT_BATCHES = [10, 100, 1000]
+DEFAULT_ROUNDS = 5
+# Calls per round for the per-consumer cases; results are also reported per call.
+LOOKUPS_PER_ROUND = 1000
+SPARSE_TOTALS_PER_ROUND = 200
+FIRST_MONTH = (4, 2023)
+BLANK_AMOUNT_SHARE = 0.1
+VERSIONED_PACKAGES = ["numpy", "pandas", "openpyxl", "docxtpl", "num2words", "pyarrow"]
+# Per-call cases that must not slow down as the sheet grows. The run fails
+# when the largest sheet costs more than this many times the smallest per call.
+FLAT_CASES = ["consumer_lookup", "period_total_range"]
+FLAT_GROWTH_LIMIT = 3.0
+NAME_WORDS = ["TEXTILES", "MILLS", "HOSPITAL", "TRADERS", "ENTERPRISES", "SONS", "INDUSTRIES", "STORES"]
+
+
+# --- SYNTHETIC DATA ---
+def month_headers(count):
+    month, year = FIRST_MONTH
+    headers = []
+    for _ in range(count):
+        headers.append(f"{MONTH_ABBR[month - 1]}-{year % 100:02d}")
+        month, year = (1, year + 1) if month == 12 else (month + 1, year)
+    return headers
+
+
+def make_bill_workbook(rows, months, seed=0):
+    # Same layout as the real BILL sheet: serial, consumer, name, address, then one column per month.
+    from openpyxl import Workbook
+
+    rnd = random.Random(seed)
+    wb = Workbook(write_only=True)
+    wb.create_sheet("SUMMARY").append(["Generated for benchmarks"])
+    ws = wb.create_sheet("BILL")
+    ws.append(["S.No", "Consumer Number", "Name", "Address"] + month_headers(months))
+    for i in range(1, rows + 1):
+        amounts = [None if rnd.random() < BLANK_AMOUNT_SHARE else rnd.randint(100, 500000) for _ in range(months)]
+        name = f"CONSUMER {i} {rnd.choice(NAME_WORDS)}"
+        ws.append([i, i, name, f"{rnd.randint(1, 300)} MAIN ROAD"] + amounts)
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def month_keys_from(start, count):
+    # `count` consecutive (month, year) keys from month index `start` of the sheet.
+    month, year = FIRST_MONTH
+    keys = []
+    for pos in range(start + count):
+        if pos >= start:
+            keys.append((month, year))
+        month, year = (1, year + 1) if month == 12 else (month + 1, year)
+    return keys
+
+
+def make_receipts(count, template_path, seed=0):
+    rnd = random.Random(seed)
+    receipts = []
+    for i in range(count):
+        row = {"Name": f"CONSUMER {i + 1} {rnd.choice(NAME_WORDS)}", "Consumer Number": f"{i % 999 + 1:03d}"}
+        instruments = [
+            {"bank": "State Bank of India", "type": "Cheque", "no": f"{100000 + i:06d}", "date": "01.02.2025"}
+        ]
+        if template_path == SD_TEMPLATE:
+            sd_amount, msd_amount = rnd.randint(1000, 200000), rnd.randint(1000, 200000)
+            total = sd_amount + msd_amount
+            fields = {
+                "purpose": "Security Deposit",
+                "selected_purpose": SD_MSD_PURPOSE,
+                "description": "Security Deposit",
+                "month": "Security Deposit",
+                "tag": SD_TAG,
+                "account": SD_ACCOUNT,
+                "breakdown": sd_msd_breakdown(sd_amount, msd_amount),
+            }
+        else:
+            start = rnd.randrange(len(MONTH_LIST))
+            period = format_period_month_text(month_range(MONTH_LIST[start], 2024, MONTH_LIST[start], 2025))
+            total = rnd.randint(100, 5000000)
+            fields = {"purpose": CC_PURPOSE, "selected_purpose": "C. C", "description": period, "month": period}
+        receipts.append(build_receipt(100 + i, "01.02.2025", row, instruments, "State Bank of India", total, **fields))
+    return receipts
+
+
+# --- MEASUREMENT ---
+def measure(fn, rounds, setup=None, warmup=True):
+    # Like timeit: the collector is off while timing. `setup` runs untimed before every round.
+    if warmup:
+        if setup:
+            setup()
+        fn()
+    times = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - started)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return times
+
+
+def result(case, params, items, times):
+    median = statistics.median(times)
+    return {
+        "case": case,
+        "params": params,
+        "items": items,
+        "rounds": len(times),
+        "min_s": min(times),
+        "median_s": median,
+        "mean_s": statistics.fmean(times),
+        "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "per_item_us": median / items * 1e6 if items else None,
+    }
+
+
+def result_key(record):
+    return record["case"], json.dumps(record["params"], sort_keys=True)
+
+
+# --- CASES ---
+def master_cases(rows, months, rounds, load_rounds, seed):
+    params = {"rows": rows, "months": months}
+    print(f"Generating BILL workbook {rows} x {months}...", file=sys.stderr)
+    raw = make_bill_workbook(rows, months, seed)
+    holder = {}
+
+    def load():
+        df, notes = parse_bill_sheet(raw)
+        holder["master"] = MasterData(df, notes=notes)
+
+    record = result("master_load", params, rows, measure(load, load_rounds, warmup=False))
+    record["workbook_bytes"] = len(raw)
+    yield record
+    master = holder["master"]
+
+    rnd = random.Random(seed)
+    consumer_keys = [normalize_consumer_number(rnd.randint(1, rows)) for _ in range(LOOKUPS_PER_ROUND)]
+    spans = []
+    for _ in range(LOOKUPS_PER_ROUND):
+        length = rnd.randint(1, months)
+        spans.append(month_keys_from(rnd.randrange(months - length + 1), length))
+    # Every other month of a span is not a range, so it takes the per-column path.
+    sparse = [keys[::2] for keys in spans[:SPARSE_TOTALS_PER_ROUND] if len(keys) > 2]
+
+    def lookups():
+        for key in consumer_keys:
+            master.find_consumer(key)
+
+    def resolve():
+        for keys in spans:
+            master.resolve_months(keys)
+
+    def range_totals():
+        for key, keys in zip(consumer_keys, spans):
+            master.period_total(key, keys)
+
+    def sparse_totals():
+        for key, keys in zip(consumer_keys, sparse):
+            master.period_total(key, keys)
+
+    yield result("consumer_lookup", params, len(consumer_keys), measure(lookups, rounds))
+    yield result("resolve_months", params, len(spans), measure(resolve, rounds))
+    yield result("period_total_range", params, len(spans), measure(range_totals, rounds))
+    yield result("period_total_sparse", params, len(sparse), measure(sparse_totals, rounds))
+
+
+def batch_cases(batch, rounds, seed):
+    params = {"receipts": batch}
+    rnd = random.Random(seed)
+    amounts = [rnd.randint(0, 10000000) for _ in range(batch)]
+
+    def currency():
+        for amount in amounts:
+            format_indian_currency(amount)
+
+    def words():
+        for amount in amounts:
+            amount_words(amount)
+
+    # Cold: the per-process format caches are emptied before each round.
+    yield result("format_indian_currency", params, batch, measure(currency, rounds, clear_format_cache))
+    yield result("amount_words", params, batch, measure(words, rounds, clear_format_cache))
+
+    for template_path in (CC_ADVANCE_TEMPLATE, SD_TEMPLATE):
+        if not templates.exists(template_path):
+            print(f"Template missing: {template_path}; skipping its render cases.", file=sys.stderr)
+            continue
+        receipts = make_receipts(batch, template_path, seed)
+        template_params = {**params, "template": template_path}
+
+        def render():
+            render_docx(template_path, receipts)
+
+        def prerender():
+            clear_fragment_cache()
+            prerender_fragments(template_path, receipts)
+
+        # Cold renders every receipt; warm is Finalize after the fragments were rendered on entry.
+        yield result("render_save_cold", template_params, batch, measure(render, rounds, clear_fragment_cache))
+        yield result("render_save_warm", template_params, batch, measure(render, rounds, prerender))
+        clear_fragment_cache()
+
+
+def run_benchmarks(args):
+    results = []
+    for rows in args.rows:
+        for months in args.months:
+            for record in master_cases(rows, months, args.rounds, args.load_rounds, args.seed):
+                report(record)
+                results.append(record)
+    for batch in args.batches:
+        for record in batch_cases(batch, args.rounds, args.seed):
+            report(record)
+            results.append(record)
+    return results
+
+
+def scaling_failures(results, limit=FLAT_GROWTH_LIMIT):
+    # For each FLAT_CASES case and month count, compares time per call on the largest sheet with the smallest.
+    by_size = {}
+    for record in results:
+        if record["case"] in FLAT_CASES:
+            key = record["case"], record["params"]["months"]
+            by_size.setdefault(key, {})[record["params"]["rows"]] = record["per_item_us"]
+    failures = []
+    for (case, months), per_rows in sorted(by_size.items()):
+        smallest, largest = min(per_rows), max(per_rows)
+        if smallest == largest or not per_rows[smallest]:
+            continue
+        growth = per_rows[largest] / per_rows[smallest]
+        if growth > limit:
+            failures.append(
+                f"{case} months={months}: {per_rows[largest]:.1f} us/call at {largest} rows is {growth:.1f}x "
+                f"the {per_rows[smallest]:.1f} us/call at {smallest} rows (limit {limit:g}x)"
+            )
+    return failures
+
+
+# --- OUTPUT ---
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+    except OSError:
+        return ""
+    return out.stdout.strip() if out.returncode == 0 else ""
+
+
+def package_versions():
+    versions = {}
+    for name in VERSIONED_PACKAGES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def run_metadata(args):
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": package_versions(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+    }
+
+
+def param_text(params):
+    return " ".join(f"{k}={v}" for k, v in params.items())
+
+
+def report(record):
+    per_item = f"  {record['per_item_us']:.1f} us/item" if record["per_item_us"] is not None else ""
+    print(
+        f"{record['case']:<24} {param_text(record['params']):<40} {record['median_s'] * 1000:>10.2f} ms{per_item}",
+        file=sys.stderr,
+    )
+
+
+def compare(baseline_path, results):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+    print(f"\nMedian vs {baseline_path}:", file=sys.stderr)
+    for record in results:
+        old = baseline.get(result_key(record))
+        if old is None or not old["median_s"]:
+            continue
+        change = (record["median_s"] / old["median_s"] - 1) * 100
+        print(
+            f"{record['case']:<24} {param_text(record['params']):<40} "
+            f"{old['median_s'] * 1000:>10.2f} -> {record['median_s'] * 1000:>10.2f} ms ({change:+.1f}%)",
+            file=sys.stderr,
+        )
+
+
+# --- ENTRY POINT ---
+def build_parser():
+    parser = argparse.ArgumentParser(description="Time master data, formatting and rendering on synthetic data.")
+    parser.add_argument(
+        "--rows", type=int, nargs="*", default=DEFAULT_ROWS, help="BILL sheet sizes (none skips the master data cases)"
+    )
+    parser.add_argument("--months", type=int, nargs="*", default=DEFAULT_MONTHS, help="Month columns per sheet")
+    parser.add_argument(
+        "--batches",
+        type=int,
+        nargs="*",
+        default=DEFAULT_BATCHES,
+        help="Receipts per batch (none skips formatting and rendering)",
+    )
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Timed rounds per case")
+    parser.add_argument("--load-rounds", type=int, default=1, help="Timed rounds for parsing each workbook")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", help="Earlier results file to print median changes against")
+    parser.add_argument("-o", "--output", help="Results file (default bench_<timestamp>.json)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if min(args.months, default=2) < 2 or min(args.rows + args.batches + [args.rounds, args.load_rounds]) < 1:
+        print("Sizes and round counts must be at least 1, --months at least 2.", file=sys.stderr)
+        return 2
+    output = os.path.abspath(args.output or f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    # Templates are looked up relative to the app directory, as when the app runs.
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    meta = run_metadata(args)
+    results = run_benchmarks(args)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Wrote {len(results)} results to {output}", file=sys.stderr)
+    if args.compare:
+        compare(args.compare, results)
+    failures = scaling_failures(results)
+    for failure in failures:
+        print(f"Not flat: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
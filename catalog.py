@@ -0,0 +1,101 @@
+OTHER_PURPOSES = [
+    "Advance Payment",
+    "Advance Security Deposit (ASD)",
+    "Security Deposit and Meter Security Deposit (SD and MSD)",
+    "Processing Fee",
+]
+
+ADVANCE_PAYMENT = OTHER_PURPOSES[0]
+ASD_PURPOSE = OTHER_PURPOSES[1]
+SD_MSD_PURPOSE = OTHER_PURPOSES[2]
+PROCESSING_FEE_PURPOSE = OTHER_PURPOSES[3]
+
+SD_TAG = "SD"
+SD_ACCOUNT = "8336 – CIVIL DEPOSITS – 101 – SECURITY DEPOSITS"
+PF_TAG = "CCC/PF"
+PF_ACCOUNT = "0801 – Power 05 – Transmission and Distribution (101) Sale of Power"
+PROCESSING_FEE_AMOUNT = 20000
+
+CC_PURPOSE = "C. C. Charges"
+
+MONTH_LIST = [
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+]
+YEAR_OPTIONS = [2026, 2025]
+
+# --- BANK LOGOS CONFIGURATION ---
+BANKS = [
+    {"name": "State Bank of India", "file": "logos/SBI.jpg"},
+    {"name": "HDFC Bank", "file": "logos/HDFC.jpg"},
+    {"name": "ICICI Bank", "file": "logos/ICICI Bank.jpg"},
+    {"name": "Axis Bank", "file": "logos/Axis Bank.jpg"},
+    {"name": "Indian Bank", "file": "logos/Indian Bank.jpg"},
+    {"name": "Canara Bank", "file": "logos/Canara.jpg"},
+    {"name": "Bank of Baroda", "file": "logos/Bank of Baroda.jpg"},
+    {"name": "Union Bank of India", "file": "logos/Union Bank of India.jpg"},
+    {"name": "Karur Vysya Bank", "file": "logos/KVB.jpg"},
+    {"name": "Yes Bank", "file": "logos/Yes Bank.jpg"},
+    {"name": "IDFC First Bank", "file": "logos/IDFC First Bank.jpg"},
+    {"name": "Bandhan Bank", "file": "logos/Bandhan Bank.jpg"},
+    {"name": "Kotak Mahindra Bank", "file": "logos/KMB.jpg"},
+    {"name": "South Indian Bank", "file": "logos/South Indian Bank.jpg"},
+    {"name": "Central Bank of India", "file": "logos/Central Bank of India.jpg"},
+    {"name": "Indian Overseas Bank", "file": "logos/Indian Overseas Bank.jpg"},
+    {"name": "Bank of India", "file": "logos/Bank of India.jpg"},
+    {"name": "UCO Bank", "file": "logos/UCO Bank.jpg"},
+    {"name": "City Union Bank", "file": "logos/City Union Bank.jpg"},
+    {"name": "Deutsche Bank", "file": "logos/Deutsche Bank.jpg"},
+    {"name": "Equitas Bank", "file": "logos/Equitas Bank.jpg"},
+    {"name": "IDBI Bank", "file": "logos/IDBI Bank.jpg"},
+    {
+        "name": "The Hongkong and Shanghai Banking Corporation",
+        "file": "logos/HSBC.jpg",
+    },
+    {
+        "name": "Tamilnad Mercantile Bank",
+        "file": "logos/Tamilnad Mercantile Bank.jpg",
+    },
+    {"name": "Karnataka Bank", "file": "logos/Karnataka Bank.jpg"},
+    {"name": "CSB Bank", "file": "logos/CSB Bank.jpg"},
+    {"name": "Punjab National Bank", "file": "logos/Punjab National Bank.jpg"},
+    {"name": "Federal Bank", "file": "logos/Federal Bank.jpg"},
+]
+
+# --- CUSTOM CSS ---
+CSS_BLOCK = r"""
+<style>
+[data-testid="stVerticalBlock"] > div { gap: 0.5rem !important; }
+div[data-testid="column"] button { margin-top: 28px !important; }
+
+[data-testid="stImage"] img {
+    width: 65px !important; height: 65px !important;
+    object-fit: contain !important; border-radius: 5px;
+    border: 1px solid #eee; display: block;
+    margin-left: auto; margin-right: auto;
+}
+
+.stMarkdown p {
+    font-size: 14px !important;
+    line-height: 1.6 !important;
+    margin-bottom: 0px !important;
+}
+
+.instrument-row {
+    background-color: #f9f9f9;
+    padding: 5px;
+    border-radius: 5px;
+    margin-bottom: 2px;
+}
+</style>
+"""
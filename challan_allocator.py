@@ -0,0 +1,160 @@
+import sqlite3
+import threading
+import time
+
+from batch_journal import JOURNAL_PATH, connect
+
+# Numbers are reserved this many at a time, so only every RESERVE_BLOCK-th
+# "Add to Batch" touches the database.
+RESERVE_BLOCK = 25
+# Reservations nobody has extended or issued for this long no longer block
+# other batches.
+STALE_RESERVATION_SECONDS = 12 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS challan_ranges (
+    holder TEXT PRIMARY KEY,
+    series TEXT NOT NULL,
+    first_no INTEGER NOT NULL,
+    last_no INTEGER NOT NULL,
+    issued_to INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS challan_ranges_series ON challan_ranges (series, first_no, last_no);
+"""
+
+# Only first_no..issued_to of a finalized batch is permanent; anything a row
+# holds past issued_to is a reservation and goes stale like any other.
+FIND_OVERLAP = (
+    "SELECT first_no, last_no, issued_to FROM challan_ranges "
+    "WHERE series = :series AND holder != :holder AND first_no <= :last "
+    "AND ((issued_to IS NOT NULL AND issued_to >= :first) OR (last_no >= :first AND updated_at >= :fresh)) "
+    "ORDER BY first_no LIMIT 1"
+)
+
+
+class AllocationError(Exception):
+    pass
+
+
+class ChallanAllocator:
+    def __init__(self, path=JOURNAL_PATH, block=RESERVE_BLOCK):
+        self.path = path
+        self.block = block
+        self.last_error = ""
+        self._conn = None
+        self._lock = threading.Lock()
+        # holder -> last reserved number, so covered numbers need no query.
+        self._reserved_to = {}
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _claim(self, holder, series, first_no, last_no):
+        # Called with self._lock held. Either the whole range becomes this
+        # holder's or nothing changes.
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            clash = conn.execute(
+                FIND_OVERLAP,
+                {
+                    "series": series,
+                    "holder": holder,
+                    "first": first_no,
+                    "last": last_no,
+                    "fresh": now - STALE_RESERVATION_SECONDS,
+                },
+            ).fetchone()
+            if clash is not None:
+                taken_first, taken_last, issued_to = clash
+                if issued_to is not None and issued_to >= first_no:
+                    state = "already issued"
+                    taken_last = issued_to
+                else:
+                    state = "reserved by another batch"
+                    if issued_to is not None:
+                        taken_first = issued_to + 1
+                lo, hi = max(first_no, taken_first), min(last_no, taken_last)
+                numbers = f"number {lo} is" if lo == hi else f"numbers {lo}-{hi} are"
+                raise AllocationError(f"Challan {numbers} {state}.")
+            # A finalized batch keeps exactly what it issued; it is never widened again.
+            claimed = conn.execute(
+                "INSERT INTO challan_ranges (holder, series, first_no, last_no, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (holder) DO UPDATE SET first_no = excluded.first_no, "
+                "last_no = MAX(last_no, excluded.last_no), updated_at = excluded.updated_at "
+                "WHERE issued_to IS NULL",
+                (holder, series, first_no, last_no, now),
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if claimed:
+            self._reserved_to[holder] = max(self._reserved_to.get(holder, last_no), last_no)
+
+    # An unusable database only turns collision checks off, like the batch
+    # journal; it never blocks entering challans.
+    def reserve(self, holder, series, first_no, count=0):
+        # Reserves first_no onwards for a new or resumed batch holding `count` receipts.
+        with self._lock:
+            try:
+                self._claim(holder, series, first_no, first_no + max(count, 0) + self.block - 1)
+            except (OSError, sqlite3.Error) as exc:
+                self.last_error = str(exc)
+
+    def ensure(self, holder, series, first_no, challan):
+        # Hot path: numbers inside the current reservation return without a query.
+        if challan <= self._reserved_to.get(holder, first_no - 1):
+            return
+        with self._lock:
+            if challan > self._reserved_to.get(holder, first_no - 1):
+                try:
+                    self._claim(holder, series, first_no, challan + self.block - 1)
+                except (OSError, sqlite3.Error) as exc:
+                    self.last_error = str(exc)
+
+    def finalize(self, holder, used_count):
+        # The numbers a finalized batch used stay issued; the rest of its
+        # reservation goes back.
+        with self._lock:
+            try:
+                self._finalize(holder, used_count)
+            except (OSError, sqlite3.Error) as exc:
+                self.last_error = str(exc)
+            self._reserved_to.pop(holder, None)
+
+    def release(self, holder):
+        # Abandoned batches give back everything they haven't issued.
+        with self._lock:
+            try:
+                self._release(holder)
+            except (OSError, sqlite3.Error) as exc:
+                self.last_error = str(exc)
+            self._reserved_to.pop(holder, None)
+
+    def _finalize(self, holder, used_count):
+        conn = self._connection()
+        if used_count > 0:
+            conn.execute(
+                "UPDATE challan_ranges SET issued_to = first_no + ?, last_no = first_no + ?, updated_at = ? "
+                "WHERE holder = ?",
+                (used_count - 1, used_count - 1, time.time(), holder),
+            )
+        else:
+            conn.execute("DELETE FROM challan_ranges WHERE holder = ? AND issued_to IS NULL", (holder,))
+
+    def _release(self, holder):
+        conn = self._connection()
+        conn.execute("DELETE FROM challan_ranges WHERE holder = ? AND issued_to IS NULL", (holder,))
+        conn.execute(
+            "UPDATE challan_ranges SET last_no = issued_to, updated_at = ? WHERE holder = ?",
+            (time.time(), holder),
+        )
+
+
+allocator = ChallanAllocator()
@@ -0,0 +1,325 @@
+import argparse
+import csv
+import re
+import sys
+import zipfile
+from datetime import date, datetime
+from itertools import chain
+
+from openpyxl.utils.exceptions import InvalidFileException
+
+from catalog import (
+    ADVANCE_PAYMENT,
+    ASD_PURPOSE,
+    CC_PURPOSE,
+    MONTH_LIST,
+    OTHER_PURPOSES,
+    PF_ACCOUNT,
+    PF_TAG,
+    PROCESSING_FEE_AMOUNT,
+    PROCESSING_FEE_PURPOSE,
+    SD_ACCOUNT,
+    SD_MSD_PURPOSE,
+    SD_TAG,
+)
+from formatting import format_period_month_text
+from master_data import MasterDataError, load_master_data, normalize_consumer_number, parse_month_header
+from receipts import build_receipt, month_keys, month_range, sd_msd_breakdown
+from rendering import DEFAULT_CHUNK_SIZE, render_docx, template_for_batch, write_docx_shards
+from template_registry import registry as templates
+
+INSTRUMENT_TYPES = {"cheque": "Cheque", "dd": "Demand Draft", "demand draft": "Demand Draft"}
+NEW_CONSUMER_PURPOSES = [SD_MSD_PURPOSE, PROCESSING_FEE_PURPOSE]
+
+
+class BatchRowError(ValueError):
+    pass
+
+
+class BatchFileError(ValueError):
+    pass
+
+
+# --- BATCH FILE READING ---
+def normalize_header(header):
+    return re.sub(r"[\s\-]+", "_", str(header or "").strip().lower())
+
+
+def iter_csv_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        headers = [normalize_header(h) for h in next(reader, [])]
+        for line_no, values in enumerate(reader, start=2):
+            if any(v.strip() for v in values):
+                yield line_no, dict(zip(headers, values))
+
+
+def iter_xlsx_rows(path, sheet_name=None):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        if sheet_name and sheet_name not in wb.sheetnames:
+            raise BatchFileError(f"Sheet '{sheet_name}' not found.")
+        ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        headers = [normalize_header(h) for h in next(rows, ())]
+        for line_no, values in enumerate(rows, start=2):
+            if any(v not in (None, "") for v in values):
+                yield line_no, dict(zip(headers, values))
+    finally:
+        wb.close()
+
+
+def iter_batch_rows(path, sheet_name=None):
+    if str(path).lower().endswith((".xlsx", ".xlsm")):
+        return iter_xlsx_rows(path, sheet_name)
+    return iter_csv_rows(path)
+
+
+# --- ROW PARSING ---
+def cell_text(record, key):
+    value = record.get(key)
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%d.%m.%Y")
+    return str(value).strip()
+
+
+def whole_number(record, key, required=True):
+    text = cell_text(record, key).replace(",", "")
+    if not text:
+        if required:
+            raise BatchRowError(f"'{key}' is required.")
+        return None
+    if not re.match(r"^\d+$", text):
+        raise BatchRowError(f"'{key}' must be a valid whole number.")
+    return int(text)
+
+
+def parse_month(token):
+    key = parse_month_header(token.strip())
+    if key is None:
+        raise BatchRowError(f"Month '{token.strip()}' must look like Jan-25.")
+    return MONTH_LIST[key[0] - 1], key[1]
+
+
+def parse_months(text):
+    if not text:
+        raise BatchRowError("'months' is required.")
+    bounds = [parse_month(part) for part in re.split(r"\s+to\s+", text, flags=re.I)]
+    if len(bounds) == 1:
+        return bounds
+    if len(bounds) != 2:
+        raise BatchRowError("'months' must be a single month or 'Jan-25 to Mar-25'.")
+    (f_month, f_year), (t_month, t_year) = bounds
+    if (f_year, MONTH_LIST.index(f_month)) > (t_year, MONTH_LIST.index(t_month)):
+        raise BatchRowError("'From' date must be before 'To' date.")
+    return month_range(f_month, f_year, t_month, t_year)
+
+
+def parse_instruments(record):
+    bank = cell_text(record, "bank")
+    if not bank:
+        raise BatchRowError("Bank Name is required.")
+    i_type = INSTRUMENT_TYPES.get(cell_text(record, "instrument_type").lower() or "cheque")
+    if i_type is None:
+        raise BatchRowError("'instrument_type' must be Cheque or Demand Draft.")
+
+    numbers = [n.strip() for n in re.split(r"[;,]", cell_text(record, "instrument_no")) if n.strip()]
+    dates = [d.strip() for d in re.split(r"[;,]", cell_text(record, "instrument_date")) if d.strip()]
+    if not numbers or not all(re.match(r"^\d{6}$", n) for n in numbers):
+        raise BatchRowError("Check Cheque/DD No. (6 digits each).")
+    if len(dates) == 1:
+        dates = dates * len(numbers)
+    if len(dates) != len(numbers):
+        raise BatchRowError("Give one 'instrument_date' or one per instrument number.")
+    for d in dates:
+        try:
+            datetime.strptime(d, "%d.%m.%Y")
+        except ValueError:
+            raise BatchRowError(f"Instrument date '{d}' must be DD.MM.YYYY.") from None
+
+    instruments = [{"bank": bank, "type": i_type, "no": n, "date": d} for n, d in zip(numbers, dates)]
+    return bank, instruments
+
+
+def find_row(master, record, purpose=None):
+    consumer = cell_text(record, "consumer") or cell_text(record, "consumer_number")
+    if consumer.upper() == "NEW":
+        if purpose not in NEW_CONSUMER_PURPOSES:
+            raise BatchRowError("New consumers are only allowed for SD and MSD or Processing Fee.")
+        name = cell_text(record, "name")
+        if not name:
+            raise BatchRowError("Please enter Consumer Name for New Consumer.")
+        return {"Name": name, "Consumer Number": "NEW"}
+
+    if not re.match(r"^\d{1,3}$", consumer):
+        raise BatchRowError("Consumer Number must be up to 3 digits.")
+    row = master.find_consumer(normalize_consumer_number(consumer))
+    if row is None:
+        raise BatchRowError(f"Consumer {consumer} not found in Master Data.")
+    return row
+
+
+def cc_receipt_fields(master, record, row):
+    target_months = parse_months(cell_text(record, "months"))
+    display_month_text = format_period_month_text(target_months)
+    total_amt = whole_number(record, "amount", required=False)
+    if total_amt is None:
+        consumer_key = normalize_consumer_number(row["Consumer Number"])
+        month_found, total_amt = master.period_total(consumer_key, month_keys(target_months))
+        if not month_found:
+            raise BatchRowError("Selected Month-Year column not found in Master Data.")
+    if total_amt <= 0:
+        raise BatchRowError("Amount is zero for selected Month-Year.")
+    return total_amt, {
+        "purpose": CC_PURPOSE,
+        "selected_purpose": "C. C",
+        "description": display_month_text,
+        "month": display_month_text,
+    }
+
+
+def other_receipt_fields(record, purpose):
+    description = cell_text(record, "description")
+    fields = {"selected_purpose": purpose, "tag": "", "account": "", "breakdown": ""}
+
+    if purpose == ADVANCE_PAYMENT:
+        target_months = parse_months(cell_text(record, "months"))
+        if len(target_months) != 1:
+            raise BatchRowError("Advance Payment takes a single month.")
+        month_name, year = target_months[0]
+        description = f"{month_name} - {year}"
+        total_amt = whole_number(record, "amount")
+        fields["purpose"] = ADVANCE_PAYMENT
+    elif purpose == SD_MSD_PURPOSE:
+        sd_amount = whole_number(record, "sd_amount")
+        msd_amount = whole_number(record, "msd_amount")
+        total_amt = sd_amount + msd_amount
+        fields.update(tag=SD_TAG, account=SD_ACCOUNT, breakdown=sd_msd_breakdown(sd_amount, msd_amount))
+    elif purpose == ASD_PURPOSE:
+        total_amt = whole_number(record, "amount")
+        fields.update(tag=SD_TAG, account=SD_ACCOUNT)
+    else:
+        total_amt = whole_number(record, "amount", required=False) or PROCESSING_FEE_AMOUNT
+        fields.update(tag=PF_TAG, account=PF_ACCOUNT)
+
+    if not description:
+        raise BatchRowError("Description is required for selected purpose.")
+    fields.setdefault("purpose", description)
+    fields.update(description=description, month=description)
+    return total_amt, fields
+
+
+def row_receipt(master, record, challan_type, challan, pdate):
+    bank, instruments = parse_instruments(record)
+    if challan_type == "C. C":
+        row = find_row(master, record)
+        total_amt, fields = cc_receipt_fields(master, record, row)
+    else:
+        purpose = cell_text(record, "purpose")
+        if purpose not in OTHER_PURPOSES:
+            raise BatchRowError(f"'purpose' must be one of: {', '.join(OTHER_PURPOSES)}.")
+        row = find_row(master, record, purpose)
+        total_amt, fields = other_receipt_fields(record, purpose)
+    return build_receipt(challan, pdate, row, instruments, bank, total_amt, **fields)
+
+
+def iter_receipts(master, rows, challan_type, start_no, pdate, errors):
+    challan = start_no
+    batch_purpose = ""
+    for line_no, record in rows:
+        try:
+            receipt = row_receipt(master, record, challan_type, challan, pdate)
+            if not batch_purpose:
+                batch_purpose = receipt["selected_purpose"]
+            elif receipt["selected_purpose"] != batch_purpose:
+                raise BatchRowError(
+                    f"Purpose '{receipt['selected_purpose']}' does not match batch purpose '{batch_purpose}'."
+                )
+        except BatchRowError as exc:
+            errors.append((line_no, str(exc)))
+            continue
+        challan += 1
+        yield receipt
+
+
+# --- ENTRY POINT ---
+def build_parser():
+    parser = argparse.ArgumentParser(description="Generate challans from a batch file without the Streamlit UI.")
+    parser.add_argument("master", help="Master Data workbook (.xlsx) with a BILL sheet")
+    parser.add_argument("batch", help="Batch rows (.csv or .xlsx)")
+    parser.add_argument("--start", type=int, required=True, help="Starting Challan number")
+    parser.add_argument("--date", default=date.today().strftime("%d.%m.%Y"), help="Challan Date, DD.MM.YYYY")
+    parser.add_argument("--type", dest="challan_type", choices=["C. C", "OTHER"], default="C. C")
+    parser.add_argument("--sheet", help="Sheet to read when the batch file is a workbook")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--zip", action="store_true", help="Write a ZIP with one document per chunk")
+    parser.add_argument("--parallel", action="store_true", help="Render chunks in a process pool")
+    parser.add_argument("-o", "--output", help="Output file (default Challans_<date>.docx/.zip)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        pdate = datetime.strptime(args.date, "%d.%m.%Y").strftime("%d.%m.%Y")
+    except ValueError:
+        print("--date must be DD.MM.YYYY", file=sys.stderr)
+        return 2
+
+    try:
+        master, _ = load_master_data(args.master)
+    except MasterDataError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    except (OSError, zipfile.BadZipFile, InvalidFileException) as exc:
+        print(f"Could not read Master Data: {exc}", file=sys.stderr)
+        return 2
+
+    errors = []
+    receipts = iter_receipts(
+        master, iter_batch_rows(args.batch, args.sheet), args.challan_type, args.start, pdate, errors
+    )
+    try:
+        first = next(receipts, None)
+    except (OSError, UnicodeDecodeError, zipfile.BadZipFile, InvalidFileException, BatchFileError) as exc:
+        print(f"Could not read batch file: {exc}", file=sys.stderr)
+        return 2
+    if first is None:
+        for line_no, message in errors:
+            print(f"Row {line_no}: {message}", file=sys.stderr)
+        print("No valid rows; nothing written.", file=sys.stderr)
+        return 2
+
+    template_path = template_for_batch(args.challan_type, [first])
+    if not templates.exists(template_path):
+        print(f"Template missing: {template_path}", file=sys.stderr)
+        return 2
+
+    receipts = chain([first], receipts)
+    output = args.output or f"Challans_{date.today()}.{'zip' if args.zip else 'docx'}"
+    written = [0]
+
+    def progress(done):
+        written[0] = done
+
+    if args.zip:
+        write_docx_shards(output, template_path, receipts, args.chunk_size, args.parallel, progress)
+    else:
+        data = render_docx(template_path, receipts, args.chunk_size, args.parallel, progress)
+        with open(output, "wb") as f:
+            f.write(data)
+
+    for line_no, message in errors:
+        print(f"Row {line_no}: {message}", file=sys.stderr)
+    print(f"Wrote {written[0]} challans ({args.start}-{args.start + written[0] - 1}) to {output}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import re
+
+import numpy as np
+
+SEARCH_RESULT_LIMIT = 10
+TOKEN_RE = re.compile(r"\w+")
+# Sorts after every other character, so [term, term + PREFIX_END) is all tokens starting with term.
+PREFIX_END = "\U0010ffff"
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).casefold())
+
+
+class ConsumerSearchIndex:
+    # Sorted (token, row) pairs over consumer names and numbers. A query term
+    # is a prefix, so each term is two binary searches; no per-query row scan.
+    def __init__(self, numbers, names):
+        self.numbers = list(numbers)
+        self.names = list(names)
+        tokens = []
+        rows = []
+        for row, (number, name) in enumerate(zip(self.numbers, self.names)):
+            row_tokens = set(tokenize(name))
+            row_tokens.add(number)
+            # "5" should find consumer "005" as well.
+            row_tokens.add(number.lstrip("0") or number)
+            tokens.extend(row_tokens)
+            rows.extend([row] * len(row_tokens))
+        order = np.argsort(np.array(tokens, dtype=str), kind="stable") if tokens else np.array([], dtype=np.int64)
+        self._tokens = np.array(tokens, dtype=str)[order]
+        self._rows = np.array(rows, dtype=np.int64)[order]
+
+    @classmethod
+    def from_consumer_index(cls, consumer_index, names):
+        # One entry per reachable consumer: duplicates resolve to their first row anyway.
+        items = sorted(consumer_index.items(), key=lambda item: item[1])
+        return cls([number for number, _ in items], [names[pos] for _, pos in items])
+
+    def _rows_for(self, term, exact=False):
+        lo = np.searchsorted(self._tokens, term, side="left")
+        hi = np.searchsorted(self._tokens, term if exact else term + PREFIX_END, side="right")
+        return np.unique(self._rows[lo:hi])
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        # Rows matching every query term as a prefix, ranked by how many terms
+        # match a whole token, then by sheet order.
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not len(self._tokens):
+            return []
+        candidates = None
+        for term in terms:
+            rows = self._rows_for(term)
+            candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+            if not len(candidates):
+                return []
+        exact_hits = np.zeros(len(candidates), dtype=np.int64)
+        for term in terms:
+            exact_hits += np.isin(candidates, self._rows_for(term, exact=True), assume_unique=True)
+        best = candidates[np.lexsort((candidates, -exact_hits))[:limit]]
+        return [(self.numbers[row], self.names[row]) for row in best]
+
+    def __len__(self):
+        return len(self.numbers)
@@ -0,0 +1,83 @@
+from functools import lru_cache
+
+import pandas as pd
+
+# Amounts repeat heavily across a batch and across reruns.
+FORMAT_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _indian_currency(value):
+    main = str(value)
+    if len(main) <= 3:
+        return main
+    last_three = main[-3:]
+    remaining = main[:-3]
+    res = ""
+    while len(remaining) > 2:
+        res = "," + remaining[-2:] + res
+        remaining = remaining[:-2]
+    if remaining:
+        res = remaining + res
+    return f"{res},{last_three}"
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _amount_words(value):
+    # num2words loads every language module it ships; only pay for that once
+    # a receipt actually needs words.
+    from num2words import num2words
+
+    return (
+        num2words(value, lang="en_IN")
+        .replace(",", "")
+        .replace(" And ", " and ")
+        .title()
+        .replace(" And ", " and ")
+    )
+
+
+def format_indian_currency(number):
+    try:
+        value = int(float(number))
+    except Exception:
+        return "0"
+    return _indian_currency(value)
+
+
+def amount_words(number):
+    return _amount_words(int(number))
+
+
+def _format_many(values, formatter):
+    # Format each distinct amount once, then broadcast back to every row.
+    series = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    formatted = pd.Series([formatter(v) for v in uniques], dtype=object)
+    result = pd.Series(formatted.to_numpy()[codes], index=series.index, dtype=object)
+    return result if isinstance(values, pd.Series) else result.tolist()
+
+
+def format_indian_currency_many(values):
+    return _format_many(values, format_indian_currency)
+
+
+def amount_words_many(values):
+    return _format_many(values, amount_words)
+
+
+def clear_format_cache():
+    _indian_currency.cache_clear()
+    _amount_words.cache_clear()
+
+
+def format_period_month_text(target_months):
+    year_to_months = {}
+    for month_name, year in target_months:
+        year_to_months.setdefault(year, []).append(month_name)
+
+    parts = []
+    for year, months in year_to_months.items():
+        parts.append(f"{', '.join(months)} - {year}")
+
+    return " and ".join(parts)
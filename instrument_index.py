@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import time
+
+from batch_journal import JOURNAL_PATH, connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issued_instruments (
+    bank TEXT NOT NULL,
+    pay_type TEXT NOT NULL,
+    pay_no TEXT NOT NULL,
+    pay_date TEXT NOT NULL,
+    batch_id TEXT NOT NULL,
+    challan INTEGER NOT NULL,
+    pdate TEXT NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS issued_instruments_key ON issued_instruments (bank, pay_type, pay_no, pay_date);
+CREATE INDEX IF NOT EXISTS issued_instruments_batch ON issued_instruments (batch_id);
+"""
+
+
+def instrument_key(bank, pay_type, pay_no, pay_date):
+    return (" ".join(str(bank).split()).casefold(), pay_type, str(pay_no).strip(), pay_date)
+
+
+def receipt_instruments(receipt):
+    instruments = receipt.get("instruments")
+    if instruments is None:
+        # Receipts journaled before instruments were kept; their date is only
+        # known when all instruments shared one.
+        dates = receipt.get("date", "").split(", ")
+        instruments = [
+            {"bank": receipt["bank"], "type": receipt["pay_type"], "no": no, "date": dates[0] if len(dates) == 1 else ""}
+            for no in receipt.get("pay_no", "").split(", ")
+            if no
+        ]
+    return instruments
+
+
+def receipt_keys(receipt):
+    return [instrument_key(i["bank"], i["type"], i["no"], i["date"]) for i in receipt_instruments(receipt)]
+
+
+class BatchInstrumentIndex:
+    # Instrument key -> receipts of the current batch that carry it. Receipts
+    # are held by reference, so renumbering after a delete needs no update.
+    def __init__(self, receipts=()):
+        self._owners = {}
+        for receipt in receipts:
+            self.add(receipt)
+
+    def add(self, receipt):
+        for key in receipt_keys(receipt):
+            self._owners.setdefault(key, []).append(receipt)
+
+    def remove(self, receipt):
+        for key in receipt_keys(receipt):
+            owners = [r for r in self._owners.get(key, ()) if r is not receipt]
+            if owners:
+                self._owners[key] = owners
+            else:
+                self._owners.pop(key, None)
+
+    def owners(self, key):
+        return self._owners.get(key, [])
+
+    def __len__(self):
+        return len(self._owners)
+
+
+class InstrumentHistory:
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.last_error = ""
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def record_batch(self, batch_id, receipts):
+        # Replaces whatever an earlier finalize of the same batch recorded.
+        rows = [
+            (*key, batch_id, receipt["challan"], receipt["pdate"], time.time())
+            for receipt in receipts
+            for key in receipt_keys(receipt)
+        ]
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute("DELETE FROM issued_instruments WHERE batch_id = ?", (batch_id,))
+                    conn.executemany("INSERT INTO issued_instruments VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+        except (OSError, sqlite3.Error) as exc:
+            self.last_error = str(exc)
+
+    def find(self, key, exclude_batch=""):
+        try:
+            with self._lock:
+                return self._connection().execute(
+                    "SELECT challan, pdate FROM issued_instruments "
+                    "WHERE bank = ? AND pay_type = ? AND pay_no = ? AND pay_date = ? AND batch_id != ? "
+                    "ORDER BY recorded_at DESC LIMIT 1",
+                    (*key, exclude_batch),
+                ).fetchone()
+        except (OSError, sqlite3.Error) as exc:
+            self.last_error = str(exc)
+            return None
+
+
+history = InstrumentHistory()
@@ -0,0 +1,71 @@
+import io
+import os
+import threading
+import time
+
+from PIL import Image, UnidentifiedImageError
+
+# Logos are shown at 65x65 (see CSS_BLOCK); ship exactly that, not the source JPEG.
+LOGO_SIZE = 65
+LOGO_BACKGROUND = (255, 255, 255)
+LOGO_QUALITY = 85
+
+# Seconds between stat() calls for a logo that was already checked.
+CHECK_INTERVAL_SECONDS = 30.0
+
+
+def make_thumbnail(path, size=LOGO_SIZE):
+    # Fit inside size x size and pad, the same box object-fit: contain draws.
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+        img.thumbnail((size, size), Image.LANCZOS)
+    canvas = Image.new("RGB", (size, size), LOGO_BACKGROUND)
+    canvas.paste(img, ((size - img.width) // 2, (size - img.height) // 2))
+    output = io.BytesIO()
+    canvas.save(output, format="JPEG", quality=LOGO_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+class LogoCache:
+    def __init__(self, size=LOGO_SIZE, check_interval=CHECK_INTERVAL_SECONDS):
+        self.size = size
+        self.check_interval = check_interval
+        # path -> (mtime_ns, thumbnail bytes or None when missing/unreadable)
+        self._entries = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and now - self._checked_at.get(path, float("-inf")) < self.check_interval:
+                return entry[1]
+
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if entry is None or entry[0] != mtime:
+                thumbnail = None
+                if mtime is not None:
+                    try:
+                        thumbnail = make_thumbnail(path, self.size)
+                    except (OSError, UnidentifiedImageError):
+                        thumbnail = None
+                entry = (mtime, thumbnail)
+                self._entries[path] = entry
+            self._checked_at[path] = now
+            return entry[1]
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._checked_at.clear()
+            else:
+                self._entries.pop(path, None)
+                self._checked_at.pop(path, None)
+
+
+logos = LogoCache()
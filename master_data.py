@@ -0,0 +1,404 @@
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from consumer_search import SEARCH_RESULT_LIMIT, ConsumerSearchIndex
+from master_validation import IGNORED_HEADER, UNPARSEABLE_HEADER, validate_bill
+from perf import timed_call
+
+BILL_SHEET = "BILL"
+CONSUMER_COLUMN = "Consumer Number"
+NAME_COLUMN = "Name"
+MONTH_ABBR = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+MONTH_HEADER_RE = re.compile(r"^([A-Za-z]{3})-(\d{2})$")
+# Headers that look meant as a month; the ones MONTH_HEADER_RE rejects are reported.
+MONTH_LIKE_RE = re.compile(r"^(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*[\s\-/.',]*\d", re.IGNORECASE)
+
+# --- CACHE CONFIGURATION ---
+CACHE_MAX_ENTRIES = 8
+CACHE_TTL_SECONDS = 6 * 60 * 60
+
+# --- SIDECAR CONFIGURATION ---
+# Bump SIDECAR_SCHEMA_VERSION whenever parse_bill_sheet changes its output.
+SIDECAR_DIR = os.environ.get("CHALLAN_CACHE_DIR", ".challan_cache")
+SIDECAR_SCHEMA_VERSION = 4
+SIDECAR_VERSION_KEY = b"challan_sidecar_version"
+SIDECAR_NOTES_KEY = b"challan_parse_notes"
+
+
+class _LRUCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_master_cache = _LRUCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+_load_locks = {}
+_load_locks_guard = threading.Lock()
+
+
+class MasterDataError(Exception):
+    pass
+
+
+def read_upload(data_file):
+    if data_file is None:
+        raise ValueError("No master data uploaded.")
+    if isinstance(data_file, (bytes, bytearray)):
+        return bytes(data_file)
+    if hasattr(data_file, "getvalue"):
+        return data_file.getvalue()
+    with open(data_file, "rb") as f:
+        return f.read()
+
+
+def workbook_digest(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def normalize_consumer_number(value):
+    text = consumer_display_text(value)
+    return text.zfill(3) if text else ""
+
+
+def build_consumer_index(df):
+    keys = df[CONSUMER_COLUMN].astype(str).map(normalize_consumer_number)
+    positions = pd.Series(range(len(keys)), index=keys.index)
+    valid = keys != ""
+    first = valid & ~keys.duplicated()
+    index = dict(zip(keys[first], positions[first]))
+
+    dup_mask = valid & keys.duplicated(keep=False)
+    duplicates = {}
+    for key, pos in zip(keys[dup_mask], positions[dup_mask]):
+        duplicates.setdefault(key, []).append(int(pos))
+    return {k: int(v) for k, v in index.items()}, duplicates
+
+
+def parse_month_header(col):
+    if isinstance(col, (datetime, pd.Timestamp)):
+        return col.month, col.year
+    match = MONTH_HEADER_RE.match(str(col).strip())
+    if match and match.group(1) in MONTH_ABBR:
+        return MONTH_ABBR.index(match.group(1)) + 1, 2000 + int(match.group(2))
+    return None
+
+
+def consumer_display_text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def compact_amounts(series):
+    amounts = pd.to_numeric(series, errors="coerce")
+    present = amounts.dropna()
+    if (
+        present.empty
+        or ((present % 1 == 0).all() and present.min() >= -(2**31) and present.max() < 2**31)
+    ):
+        return amounts.astype("Int32")
+    return amounts.astype("float64")
+
+
+def month_header_text(month, year):
+    return f"{MONTH_ABBR[month - 1]}-{str(year)[2:]}"
+
+
+def amount_value(value):
+    # Same result as pd.to_numeric(errors="coerce") for one cell.
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return np.nan
+    return np.nan
+
+
+def select_bill_columns(header):
+    # Header position for each needed column; the first of any duplicates
+    # wins. Month headers are keyed in canonical "Mon-YY" text so the frame has
+    # plain string columns. Also returns the header problems for the report.
+    from openpyxl.utils import get_column_letter
+
+    selected = {}
+    header_notes = []
+    for pos, col in enumerate(header):
+        if col in (CONSUMER_COLUMN, NAME_COLUMN):
+            name = col
+        else:
+            key = parse_month_header(col)
+            name = month_header_text(*key) if key else None
+        where = f"Column {get_column_letter(pos + 1)}: {col}"
+        if name is None:
+            if col is not None and MONTH_LIKE_RE.match(str(col).strip()):
+                header_notes.append([UNPARSEABLE_HEADER, where])
+        elif name in selected:
+            header_notes.append([IGNORED_HEADER, where])
+        else:
+            selected[name] = pos
+    return selected, header_notes
+
+
+def parse_bill_sheet(raw):
+    from openpyxl import load_workbook
+
+    # Read-only mode streams the sheet's XML row by row. Only the needed cells
+    # of each row are kept, so memory follows the output, not the workbook.
+    wb = load_workbook(io.BytesIO(raw), read_only=True, data_only=True)
+    try:
+        if BILL_SHEET not in wb.sheetnames:
+            raise MasterDataError(f"Sheet '{BILL_SHEET}' not found.")
+        ws = wb[BILL_SHEET]
+        # Some writers store a wrong sheet size, which would cut the rows short.
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        selected, header_notes = select_bill_columns(next(rows, ()))
+        missing = [col for col in (CONSUMER_COLUMN, NAME_COLUMN) if col not in selected]
+        if missing:
+            raise MasterDataError(f"Sheet '{BILL_SHEET}' is missing column(s): {', '.join(missing)}")
+
+        consumer_pos = selected[CONSUMER_COLUMN]
+        name_pos = selected[NAME_COLUMN]
+        month_pos = {header: pos for header, pos in selected.items() if header not in (CONSUMER_COLUMN, NAME_COLUMN)}
+        consumers = []
+        names = []
+        amounts = {header: array("d") for header in month_pos}
+        # (row, header, text) of cells that hold something other than a number.
+        non_numeric = []
+        # Blank rows count only once a later row has data; trailing ones are dropped.
+        blank_rows = 0
+        for row in rows:
+            if all(v is None for v in row):
+                blank_rows += 1
+                continue
+            for values in [()] * blank_rows + [row]:
+                width = len(values)
+                consumers.append(consumer_display_text(values[consumer_pos] if consumer_pos < width else None))
+                name = values[name_pos] if name_pos < width else None
+                names.append("" if name is None else str(name))
+                for header, pos in month_pos.items():
+                    value = values[pos] if pos < width else None
+                    amount = amount_value(value)
+                    if amount != amount and value is not None and str(value).strip():
+                        non_numeric.append([len(names) - 1, header, str(value)])
+                    amounts[header].append(amount)
+            blank_rows = 0
+    finally:
+        wb.close()
+
+    compact = {}
+    for header, pos in sorted(selected.items(), key=lambda item: item[1]):
+        # Consumer numbers and names are nearly all distinct: plain object columns,
+        # since categoricals save nothing here and make every df.iloc row O(n).
+        if header == CONSUMER_COLUMN:
+            compact[header] = pd.Series(consumers, dtype=object)
+        elif header == NAME_COLUMN:
+            compact[header] = pd.Series(names, dtype=object)
+        else:
+            compact[header] = compact_amounts(pd.Series(np.frombuffer(amounts[header], dtype="float64")))
+    return pd.DataFrame(compact), {"headers": header_notes, "cells": non_numeric}
+
+
+def build_month_columns(columns):
+    month_columns = {}
+    for pos, col in enumerate(columns):
+        key = parse_month_header(col)
+        if key is not None:
+            month_columns.setdefault(key, pos)
+    return month_columns
+
+
+def build_month_prefix_sums(df, month_columns):
+    # Months in chronological order, as (year, month) so they sort naturally.
+    month_order = sorted((year, month) for month, year in month_columns)
+    col_positions = [month_columns[(month, year)] for year, month in month_order]
+    amounts = df.iloc[:, col_positions].apply(pd.to_numeric, errors="coerce")
+    values = amounts.to_numpy(dtype="float64", na_value=0.0)
+
+    exact = np.isfinite(values).all() and (values % 1 == 0).all()
+    dtype = "int64" if exact else "float64"
+    prefix = np.zeros((len(df), len(month_order) + 1), dtype=dtype)
+    np.cumsum(values.astype(dtype), axis=1, out=prefix[:, 1:])
+    return month_order, prefix
+
+
+class MasterData:
+    def __init__(self, df, digest="", notes=None):
+        self.df = df
+        self.digest = digest
+        self.validation = validate_bill(df, CONSUMER_COLUMN, NAME_COLUMN, notes)
+        self.consumer_index, self.duplicate_consumers = build_consumer_index(df)
+        self.month_columns = build_month_columns(df.columns)
+        self.month_order, self.month_prefix = build_month_prefix_sums(df, self.month_columns)
+        self.search_index = ConsumerSearchIndex.from_consumer_index(
+            self.consumer_index, df[NAME_COLUMN].astype(str).tolist()
+        )
+
+    @timed_call("consumer_lookup")
+    def find_consumer(self, consumer_number):
+        pos = self.consumer_index.get(consumer_number)
+        if pos is None:
+            return None
+        return self.df.iloc[pos]
+
+    def resolve_months(self, months):
+        return [self.month_columns[key] for key in months if key in self.month_columns]
+
+    def range_total(self, consumer_number, start, end):
+        # start/end are (month, year); months missing from the sheet are skipped,
+        # NaN amounts count as 0.
+        pos = self.consumer_index.get(consumer_number)
+        lo = bisect_left(self.month_order, (start[1], start[0]))
+        hi = bisect_right(self.month_order, (end[1], end[0]))
+        if pos is None or hi <= lo:
+            return False, 0
+        total = self.month_prefix[pos, hi] - self.month_prefix[pos, lo]
+        if self.month_prefix.dtype.kind == "f":
+            total = round(float(total), 6)
+        return True, total
+
+    @timed_call("period_total")
+    def period_total(self, consumer_number, months):
+        months = list(months)
+        if not months:
+            return False, 0
+        start = min(months, key=lambda key: (key[1], key[0]))
+        end = max(months, key=lambda key: (key[1], key[0]))
+        span = (end[1] - start[1]) * 12 + end[0] - start[0] + 1
+        if len(set(months)) == span:
+            return self.range_total(consumer_number, start, end)
+
+        pos = self.consumer_index.get(consumer_number)
+        col_positions = self.resolve_months(months)
+        if pos is None or not col_positions:
+            return False, 0
+        amounts = pd.to_numeric(self.df.iloc[pos, col_positions], errors="coerce")
+        return True, amounts.fillna(0).sum()
+
+    def search_consumers(self, query, limit=SEARCH_RESULT_LIMIT):
+        return self.search_index.search(query, limit)
+
+    def duplicate_count(self, consumer_number):
+        return len(self.duplicate_consumers.get(consumer_number, ()))
+
+
+def sidecar_path(digest):
+    return os.path.join(SIDECAR_DIR, f"bill-{digest}.v{SIDECAR_SCHEMA_VERSION}.arrow")
+
+
+def write_sidecar(df, digest, notes=None):
+    path = sidecar_path(digest)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SIDECAR_VERSION_KEY] = str(SIDECAR_SCHEMA_VERSION).encode()
+    metadata[SIDECAR_NOTES_KEY] = json.dumps(notes or {}).encode()
+    table = table.replace_schema_metadata(metadata)
+    try:
+        os.makedirs(SIDECAR_DIR, exist_ok=True)
+        # Uncompressed, so a reload is one binary read with no decompression.
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_sidecar(digest):
+    path = sidecar_path(digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = feather.read_table(path)
+    except (OSError, pa.ArrowException):
+        return None
+    metadata = table.schema.metadata or {}
+    if metadata.get(SIDECAR_VERSION_KEY) != str(SIDECAR_SCHEMA_VERSION).encode():
+        return None
+    # to_pandas copies the columns into ordinary pandas memory; the lookup and
+    # validation code wants numpy-backed columns, not Arrow-backed ones. Text
+    # columns come back as str, so restore the object dtype a cold parse gives.
+    df = table.to_pandas().astype({CONSUMER_COLUMN: object, NAME_COLUMN: object})
+    return df, json.loads(metadata.get(SIDECAR_NOTES_KEY, b"{}"))
+
+
+def _lock_for(key):
+    with _load_locks_guard:
+        return _load_locks.setdefault(key, threading.Lock())
+
+
+@timed_call("workbook_load")
+def load_master_data(data_file):
+    raw = read_upload(data_file)
+    key = workbook_digest(raw)
+    master = _master_cache.get(key)
+    if master is not None:
+        return master, "memory"
+
+    # Sessions uploading the same workbook wait for one parse and share its result.
+    with _lock_for(key):
+        master = _master_cache.get(key)
+        source = "memory"
+        if master is None:
+            parsed = read_sidecar(key)
+            source = "sidecar"
+            if parsed is None:
+                parsed = parse_bill_sheet(raw)
+                write_sidecar(parsed[0], key, parsed[1])
+                source = "workbook"
+            df, notes = parsed
+            master = MasterData(df, digest=key, notes=notes)
+            _master_cache.put(key, master)
+    with _load_locks_guard:
+        _load_locks.pop(key, None)
+    return master, source
+
+
+def clear_master_cache():
+    _master_cache.clear()
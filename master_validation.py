@@ -0,0 +1,171 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Data row i of the frame is this row of the BILL sheet (row 1 is the header).
+FIRST_DATA_ROW = 2
+HEADER_ROW = 1
+VALID_CONSUMER_PATTERN = r"\d{1,3}"
+REPORT_COLUMNS = ["Row", "Consumer Number", "Name", "Issue", "Detail"]
+
+# --- ISSUES ---
+UNPARSEABLE_HEADER = "Unparseable month header"
+IGNORED_HEADER = "Duplicate column (ignored)"
+MISSING_CONSUMER = "Missing consumer number"
+MALFORMED_CONSUMER = "Malformed consumer number"
+DUPLICATE_CONSUMER = "Duplicate consumer number"
+NON_NUMERIC_AMOUNT = "Non-numeric amount"
+NEGATIVE_AMOUNT = "Negative amount"
+BLANK_AMOUNT = "Blank amount (counted as 0)"
+ISSUE_ORDER = [
+    UNPARSEABLE_HEADER,
+    IGNORED_HEADER,
+    MISSING_CONSUMER,
+    MALFORMED_CONSUMER,
+    DUPLICATE_CONSUMER,
+    NON_NUMERIC_AMOUNT,
+    NEGATIVE_AMOUNT,
+    BLANK_AMOUNT,
+]
+
+
+class ValidationReport:
+    def __init__(self, issues):
+        self.issues = issues
+        self._csv = None
+        self._lock = threading.Lock()
+
+    def summary(self):
+        counts = self.issues["Issue"].value_counts()
+        return pd.DataFrame(
+            {"Issue": issue, "Rows": int(counts[issue])} for issue in ISSUE_ORDER if issue in counts
+        )
+
+    def to_csv(self):
+        # Built on the first download, then shared by every session on this workbook.
+        with self._lock:
+            if self._csv is None:
+                self._csv = self.issues.to_csv(index=False).encode("utf-8-sig")
+            return self._csv
+
+    def __len__(self):
+        return len(self.issues)
+
+
+def issue_frame(rows, consumers, names, issue, details):
+    return pd.DataFrame(
+        {
+            "Row": rows,
+            "Consumer Number": consumers,
+            "Name": names,
+            "Issue": issue,
+            "Detail": details,
+        },
+        columns=REPORT_COLUMNS,
+    )
+
+
+def cell_details(mask, headers, texts=None):
+    # One detail string per flagged row listing its flagged month columns in
+    # sheet order, with each cell's text when given. Loops over columns, not rows.
+    idx = np.flatnonzero(mask.any(axis=1))
+    flagged = mask[idx]
+    details = np.full(len(idx), "", dtype=object)
+    for col, header in enumerate(headers):
+        hit = np.flatnonzero(flagged[:, col])
+        if not len(hit):
+            continue
+        if texts is None:
+            details[hit] = details[hit] + (", " + header)
+        else:
+            details[hit] = details[hit] + (", " + header + " (") + texts(idx[hit], col) + ")"
+    return idx, np.array([detail[2:] for detail in details], dtype=object)
+
+
+def validate_bill(df, consumer_column, name_column, notes=None):
+    # Every other column of the frame is a month column.
+    notes = notes or {}
+    n = len(df)
+    month_headers = np.array([c for c in df.columns if c not in (consumer_column, name_column)], dtype=object)
+    row_numbers = np.arange(n) + FIRST_DATA_ROW
+    frames = []
+
+    header_notes = notes.get("headers", ())
+    if header_notes:
+        frames.append(
+            issue_frame(
+                [HEADER_ROW] * len(header_notes),
+                "",
+                "",
+                [issue for issue, _ in header_notes],
+                [detail for _, detail in header_notes],
+            )
+        )
+
+    # Consumer checks run over the distinct values, then map back through the codes.
+    consumer = df[consumer_column].astype("category")
+    categories = pd.Series(consumer.cat.categories.astype(str))
+    codes = consumer.cat.codes.to_numpy()
+    present = codes >= 0
+    codes = np.where(present, codes, 0)
+    consumer_text = np.where(present, categories.to_numpy(dtype=object)[codes], "")
+    blank_consumer = ~present | (categories.str.strip() == "").to_numpy()[codes]
+    malformed = ~blank_consumer & ~categories.str.fullmatch(VALID_CONSUMER_PATTERN).to_numpy(dtype=bool)[codes]
+    keys = np.where(blank_consumer, "", categories.str.zfill(3).to_numpy(dtype=object)[codes])
+    names = df[name_column].astype(str).to_numpy(dtype=object)
+
+    values = df[list(month_headers)].to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.isnan(values)
+    non_numeric = np.zeros(values.shape, dtype=bool)
+    texts = {}
+    col_of = {header: j for j, header in enumerate(month_headers)}
+    for r, header, text in notes.get("cells", ()):
+        if header in col_of and r < n:
+            non_numeric[r, col_of[header]] = True
+            texts[(r, col_of[header])] = text
+    # Rows with nothing in them are padding between consumers, not data.
+    empty_row = blank_consumer & (names == "") & missing.all(axis=1) & ~non_numeric.any(axis=1)
+
+    def add_rows(mask, issue, details=""):
+        idx = np.flatnonzero(mask)
+        if len(idx):
+            detail = details[idx] if isinstance(details, np.ndarray) else details
+            frames.append(issue_frame(row_numbers[idx], consumer_text[idx], names[idx], issue, detail))
+
+    add_rows(blank_consumer & ~empty_row, MISSING_CONSUMER)
+    add_rows(malformed, MALFORMED_CONSUMER, "Expected up to 3 digits")
+
+    duplicate = ~blank_consumer & pd.Series(keys).duplicated(keep=False).to_numpy()
+    if duplicate.any():
+        rows_by_key = pd.Series(row_numbers[duplicate]).groupby(keys[duplicate]).agg(
+            lambda rows: "Rows " + ", ".join(map(str, rows))
+        )
+        details = np.full(n, "", dtype=object)
+        details[duplicate] = rows_by_key.reindex(keys[duplicate]).to_numpy()
+        add_rows(duplicate, DUPLICATE_CONSUMER, details)
+
+    def noted_text(rows, col):
+        return np.array([texts[(r, col)] for r in rows], dtype=object)
+
+    def amount_text(rows, col):
+        return np.array([f"{v:g}" for v in values[rows, col]], dtype=object)
+
+    blank = missing & ~non_numeric & ~empty_row[:, None]
+    for mask, issue, cell_text in [
+        (non_numeric, NON_NUMERIC_AMOUNT, noted_text),
+        (values < 0, NEGATIVE_AMOUNT, amount_text),
+        (blank, BLANK_AMOUNT, None),
+    ]:
+        if mask.any():
+            idx, details = cell_details(mask, month_headers, cell_text)
+            if issue == BLANK_AMOUNT:
+                details[blank[idx].all(axis=1)] = "All months"
+            frames.append(issue_frame(row_numbers[idx], consumer_text[idx], names[idx], issue, details))
+
+    if not frames:
+        return ValidationReport(pd.DataFrame(columns=REPORT_COLUMNS))
+    issues = pd.concat(frames, ignore_index=True)
+    order = issues["Issue"].map({issue: i for i, issue in enumerate(ISSUE_ORDER)}).to_numpy()
+    issues = issues.iloc[np.lexsort((order, issues["Row"].to_numpy()))].reset_index(drop=True)
+    return ValidationReport(issues)
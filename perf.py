@@ -0,0 +1,152 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+import numpy as np
+
+# Timing is off unless CHALLAN_PERF is set or a log path is given; a disabled
+# timer is one flag check and a shared no-op context manager.
+PERF_LOG_PATH = os.environ.get("CHALLAN_PERF_LOG", "")
+PERF_ENABLED = os.environ.get("CHALLAN_PERF", "") not in ("", "0") or bool(PERF_LOG_PATH)
+# Samples kept per phase for the percentiles; count and max cover every sample.
+SAMPLE_WINDOW = 1024
+
+
+class PhaseStats:
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def summary(self):
+        p50, p95 = np.percentile(np.fromiter(self.samples, dtype="float64"), [50, 95]) * 1000
+        return {
+            "count": self.count,
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class Timings:
+    def __init__(self, name=""):
+        self.name = name
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            stats = self._phases.get(phase)
+            if stats is None:
+                stats = self._phases[phase] = PhaseStats()
+            stats.add(seconds)
+
+    def summary(self):
+        with self._lock:
+            return [{"phase": phase, **stats.summary()} for phase, stats in sorted(self._phases.items())]
+
+    def clear(self):
+        with self._lock:
+            self._phases.clear()
+
+
+class JsonLinesLog:
+    def __init__(self, path):
+        self.path = path
+        self.last_error = ""
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self.last_error:
+                return
+            try:
+                if self._file is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line)
+            except OSError as exc:
+                # Monitoring must never break the app; stop logging instead.
+                self.last_error = str(exc)
+
+
+process_timings = Timings("process")
+perf_log = JsonLinesLog(PERF_LOG_PATH) if PERF_LOG_PATH else None
+_session = contextvars.ContextVar("challan_perf_session", default=None)
+
+
+def bind_session(timings):
+    # Timings recorded in this thread (and in threads started with a copy of
+    # its context) also go to `timings`.
+    _session.set(timings)
+
+
+def record(phase, seconds, **fields):
+    process_timings.record(phase, seconds)
+    session = _session.get()
+    if session is not None:
+        session.record(phase, seconds)
+    if perf_log is not None:
+        perf_log.write(
+            {
+                "ts": time.time(),
+                "phase": phase,
+                "ms": round(seconds * 1000, 3),
+                "session": session.name if session is not None else "",
+                "pid": os.getpid(),
+                **fields,
+            }
+        )
+
+
+class _Timer:
+    __slots__ = ("phase", "fields", "started")
+
+    def __init__(self, phase, fields):
+        self.phase = phase
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.phase, time.perf_counter() - self.started, **self.fields)
+        return False
+
+
+_disabled = contextlib.nullcontext()
+
+
+def timed(phase, **fields):
+    if not PERF_ENABLED:
+        return _disabled
+    return _Timer(phase, fields)
+
+
+def timed_call(phase):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not PERF_ENABLED:
+                return fn(*args, **kwargs)
+            with _Timer(phase, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
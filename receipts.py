@@ -0,0 +1,82 @@
+import uuid
+from datetime import datetime
+
+from catalog import MONTH_LIST
+from formatting import amount_words, format_indian_currency
+
+
+def month_range(f_month, f_year, t_month, t_year):
+    start_date = datetime(f_year, MONTH_LIST.index(f_month) + 1, 1)
+    end_date = datetime(t_year, MONTH_LIST.index(t_month) + 1, 1)
+
+    target_months = []
+    curr = start_date
+    while curr <= end_date:
+        target_months.append((MONTH_LIST[curr.month - 1], curr.year))
+        curr = (
+            datetime(curr.year + 1, 1, 1)
+            if curr.month == 12
+            else datetime(curr.year, curr.month + 1, 1)
+        )
+    return target_months
+
+
+def month_keys(target_months):
+    return [(MONTH_LIST.index(m) + 1, y) for m, y in target_months]
+
+
+def build_receipt(
+    challan,
+    pdate,
+    row,
+    instruments,
+    bank,
+    total_amt,
+    purpose="",
+    selected_purpose="C. C",
+    description="",
+    tag="",
+    account="",
+    breakdown="",
+    month="",
+):
+    return {
+        "id": str(uuid.uuid4()),
+        "challan": challan,
+        "pdate": pdate,
+        "name": row["Name"],
+        "num": row["Consumer Number"],
+        "purpose": purpose,
+        "selected_purpose": selected_purpose,
+        "description": description,
+        "tag": tag,
+        "account": account,
+        "breakdown": breakdown,
+        "amount": format_indian_currency(total_amt),
+        "words": amount_words(total_amt),
+        "pay_type": instruments[0]["type"],
+        "pay_no": ", ".join([i["no"] for i in instruments]),
+        "bank": bank,
+        # Ordered de-duplication keeps the rendered text stable between runs.
+        "date": ", ".join(dict.fromkeys(i["date"] for i in instruments)),
+        "month": month,
+        "instruments": [dict(i) for i in instruments],
+    }
+
+
+def sd_msd_breakdown(sd_amount, msd_amount):
+    return (
+        f"[S.D     : {format_indian_currency(sd_amount)}]\n"
+        f"[M.S.D : {format_indian_currency(msd_amount)}]"
+    )
+
+
+def remove_receipt(receipts, receipt_id):
+    # Later challans move down one number so the batch stays contiguous.
+    for i, rec in enumerate(receipts):
+        if rec["id"] == receipt_id:
+            del receipts[i]
+            for later in receipts[i:]:
+                later["challan"] -= 1
+            return True
+    return False
@@ -0,0 +1,85 @@
+import contextvars
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Finished jobs (and their output bytes) kept for reuse across reruns.
+MAX_FINISHED_JOBS = 16
+
+
+class RenderJob:
+    def __init__(self, key, total, file_name):
+        self.id = str(uuid.uuid4())
+        self.key = key
+        self.total = total
+        self.file_name = file_name
+        self.done = 0
+        self.status = "running"
+        self.result = None
+        self.error = ""
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def update(self, done):
+        self.done = done
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+
+_jobs = OrderedDict()
+_jobs_by_key = {}
+_lock = threading.Lock()
+
+
+def batch_fingerprint(receipts, *parts):
+    payload = json.dumps([parts, receipts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_job(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def submit(key, total, file_name, render, *args, **kwargs):
+    # A batch that is already rendering or rendered is never started again.
+    with _lock:
+        job = _jobs_by_key.get(key)
+        if job is not None and job.status != "error":
+            _jobs.move_to_end(job.id)
+            return job
+        job = RenderJob(key, total, file_name)
+        _jobs[job.id] = job
+        _jobs_by_key[key] = job
+
+    # The copied context keeps the submitting session's timings bound.
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(_run, job, render, args, kwargs), daemon=True)
+    thread.start()
+    return job
+
+
+def _run(job, render, args, kwargs):
+    try:
+        job.result = render(*args, progress=job.update, **kwargs)
+        job.done = job.total
+        job.status = "done"
+    except Exception as exc:
+        job.error = str(exc) or exc.__class__.__name__
+        job.status = "error"
+    job.finished_at = time.time()
+    _evict_finished()
+
+
+def _evict_finished():
+    with _lock:
+        finished = [job for job in _jobs.values() if not job.running]
+        for job in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del _jobs[job.id]
+            if _jobs_by_key.get(job.key) is job:
+                del _jobs_by_key[job.key]
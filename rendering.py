@@ -0,0 +1,298 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from xml.sax.saxutils import escape as xml_escape
+
+from perf import timed, timed_call
+from template_registry import CC_ADVANCE_TEMPLATE, SD_TEMPLATE, registry as templates
+
+DEFAULT_CHUNK_SIZE = 100
+
+# --- PARALLEL RENDERING ---
+# Batches smaller than this render in-process; starting workers costs more.
+PARALLEL_MIN_RECEIPTS = 200
+RENDER_WORKERS = int(os.environ.get("CHALLAN_RENDER_WORKERS", "0")) or os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# --- FRAGMENT CACHE ---
+# Rendered receipt fragments run to ~100 KB of XML each; they are kept
+# zlib-compressed (about 10x smaller) under this total size.
+FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get("CHALLAN_FRAGMENT_CACHE_MB", "64")) * 1024 * 1024
+# Receipt fields that never reach the template.
+UNRENDERED_FIELDS = ("id", "instruments")
+# Control characters are not allowed in XML at all; a batch holding any goes
+# through docxtpl's lenient parse instead of the stitch. "&", "<" and ">" are
+# escaped in template_receipt, so firm names like "A & B Traders" stay plain.
+UNSAFE_TEXT_RE = re.compile(r"[\x00-\x06\x08\x0b\x0e-\x1f]")
+
+
+class SafeReceipt(dict):
+    def __getattr__(self, key):
+        return self.get(key, "")
+
+
+def template_receipt(receipt):
+    # docxtpl inserts values into the XML as they are; escape them so the text
+    # survives instead of being dropped by the lenient parse.
+    return SafeReceipt({k: xml_escape(v) if isinstance(v, str) else v for k, v in receipt.items()})
+
+
+class _FragmentCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                return None
+            self._items.move_to_end(key)
+        return zlib.decompress(data).decode("utf-8")
+
+    def put(self, key, fragment):
+        data = zlib.compress(fragment.encode("utf-8"), 1)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+_fragment_cache = _FragmentCache(FRAGMENT_CACHE_MAX_BYTES)
+
+
+def template_for_batch(challan_type, receipts):
+    if challan_type == "C. C":
+        return CC_ADVANCE_TEMPLATE
+    first_selected_purpose = receipts[0].get("selected_purpose", "") if receipts else ""
+    return CC_ADVANCE_TEMPLATE if first_selected_purpose == "Advance Payment" else SD_TEMPLATE
+
+
+def iter_chunks(items, chunk_size):
+    chunk_size = max(1, int(chunk_size or DEFAULT_CHUNK_SIZE))
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@timed_call("fragment_render")
+def render_fragments(template_path, receipts):
+    parts = templates.get(template_path).loop_parts()
+    return [parts.render_item(template_receipt(r)) for r in receipts]
+
+
+def receipt_key(receipt):
+    content = {k: v for k, v in receipt.items() if k not in UNRENDERED_FIELDS}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def prerender_fragments(template_path, receipts):
+    # Called as receipts are added or edited, so Finalize finds their
+    # fragments already rendered.
+    entry = templates.get(template_path)
+    if entry is None or entry.loop_parts() is None:
+        return
+    for receipt in receipts:
+        key = (entry.digest, receipt_key(receipt))
+        if _fragment_cache.get(key) is None:
+            _fragment_cache.put(key, render_fragments(template_path, [receipt])[0])
+
+
+def is_plain_receipt(receipt):
+    return not any(isinstance(v, str) and UNSAFE_TEXT_RE.search(v) for v in receipt.values())
+
+
+def missing_chunks(digest, chunks, lookups):
+    # Yields only the receipts without a cached fragment; what was found is
+    # queued in `lookups`, one entry per chunk, for the caller to merge back.
+    for chunk in chunks:
+        keys = [receipt_key(r) for r in chunk]
+        found = [_fragment_cache.get((digest, key)) for key in keys]
+        lookups.append((keys, found, all(is_plain_receipt(r) for r in chunk)))
+        yield [r for r, fragment in zip(chunk, found) if fragment is None]
+
+
+def missing_count(digest, receipts):
+    return sum((digest, receipt_key(r)) not in _fragment_cache for r in receipts)
+
+
+def fragment_digest(template_path):
+    # Digest the fragment cache is keyed on, or None when the template is not
+    # rendered per receipt.
+    entry = templates.get(template_path)
+    return entry.digest if entry is not None and entry.loop_parts() is not None else None
+
+
+def clear_fragment_cache():
+    _fragment_cache.clear()
+
+
+def get_render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the Streamlit server is multi-threaded.
+            _pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def shutdown_render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def ordered_map(fn, template_path, chunks, window):
+    # Like Executor.map, but keeps at most `window` chunks in flight so results
+    # waiting to be consumed in order stay bounded. Empty chunks (everything
+    # already cached) yield [] in place and are never sent to a worker.
+    pool = get_render_pool()
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(fn, template_path, chunk) if chunk else None)
+        if len(pending) >= window:
+            future = pending.popleft()
+            yield future.result() if future is not None else []
+    while pending:
+        future = pending.popleft()
+        yield future.result() if future is not None else []
+
+
+def use_parallel(receipts, parallel, digest=None):
+    # Decided on the receipts still to render: with their fragments cached,
+    # Finalize only stitches, and starting workers would cost more than that.
+    if parallel is False or RENDER_WORKERS <= 1:
+        return False
+    if not hasattr(receipts, "__len__"):
+        return bool(parallel)
+    to_render = missing_count(digest, receipts) if digest is not None else len(receipts)
+    return to_render >= (PARALLEL_MIN_RECEIPTS if parallel is None else 1)
+
+
+def parallel_chunk_size(receipts, chunk_size):
+    # Give every worker something to do even when the batch is below
+    # RENDER_WORKERS * chunk_size.
+    chunk_size = int(chunk_size or DEFAULT_CHUNK_SIZE)
+    if not hasattr(receipts, "__len__"):
+        return chunk_size
+    per_worker = -(-len(receipts) // RENDER_WORKERS)
+    return max(1, min(chunk_size, per_worker))
+
+
+def save_document(doc):
+    output = io.BytesIO()
+    with timed("doc_save"):
+        doc.save(output)
+    return output.getvalue()
+
+
+def render_docx(template_path, receipts, chunk_size=DEFAULT_CHUNK_SIZE, parallel=False, progress=None):
+    doc = templates.new_document(template_path)
+    if doc.entry.loop_parts() is None:
+        safe_receipts = [template_receipt(r) for r in receipts]
+        with timed("doc_render", receipts=len(safe_receipts)):
+            doc.render({"receipts": safe_receipts})
+        if progress:
+            progress(len(safe_receipts))
+        return save_document(doc)
+
+    # Jinja only ever sees one chunk of receipts at a time, and only the
+    # receipts whose fragments aren't cached yet; the fragments are stitched
+    # into the template shell in challan order.
+    digest = doc.entry.digest
+    lookups = deque()
+    fragments = []
+    plain = True
+    if use_parallel(receipts, parallel, digest):
+        chunks = missing_chunks(digest, iter_chunks(receipts, parallel_chunk_size(receipts, chunk_size)), lookups)
+        rendered = ordered_map(render_fragments, template_path, chunks, RENDER_WORKERS * 2)
+    else:
+        chunks = missing_chunks(digest, iter_chunks(receipts, chunk_size), lookups)
+        rendered = (render_fragments(template_path, chunk) if chunk else [] for chunk in chunks)
+    for chunk_fragments in rendered:
+        keys, found, chunk_plain = lookups.popleft()
+        plain = plain and chunk_plain
+        new_fragments = iter(chunk_fragments)
+        for key, fragment in zip(keys, found):
+            if fragment is None:
+                fragment = next(new_fragments)
+                _fragment_cache.put((digest, key), fragment)
+            fragments.append(fragment)
+        if progress:
+            progress(len(fragments))
+    if plain and doc.entry.shell() is not None:
+        # Render and save in one: the fragments go straight into the shell.
+        with timed("doc_stitch", receipts=len(fragments)):
+            return doc.entry.stitch(fragments)
+    with timed("doc_render", receipts=len(fragments)):
+        doc.render_fragments(fragments)
+    return save_document(doc)
+
+
+def shard_name(chunk):
+    return f"Challans_{chunk[0].get('challan', '')}-{chunk[-1].get('challan', '')}.docx"
+
+
+def render_shard(template_path, chunk):
+    return shard_name(chunk), render_docx(template_path, chunk, len(chunk)), len(chunk)
+
+
+def write_docx_shards(target, template_path, receipts, chunk_size=DEFAULT_CHUNK_SIZE, parallel=False, progress=None):
+    # One complete document per chunk, so peak memory follows the chunk size.
+    chunks = iter_chunks(receipts, chunk_size)
+    # Workers can't see this process's fragment cache; count only what it lacks.
+    if use_parallel(receipts, parallel, fragment_digest(template_path)):
+        shards = ordered_map(render_shard, template_path, chunks, RENDER_WORKERS)
+    else:
+        shards = (render_shard(template_path, chunk) for chunk in chunks)
+
+    done = 0
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data, count in shards:
+            zf.writestr(name, data)
+            done += count
+            if progress:
+                progress(done)
+
+
+def render_docx_shards(template_path, receipts, chunk_size=DEFAULT_CHUNK_SIZE, parallel=False, progress=None):
+    output = io.BytesIO()
+    write_docx_shards(output, template_path, receipts, chunk_size, parallel, progress)
+    return output.getvalue()
@@ -0,0 +1,28 @@
+import io
+
+from docxtpl import DocxTemplate
+
+
+class PreparsedDocxTemplate(DocxTemplate):
+    def __init__(self, entry):
+        super().__init__(io.BytesIO(entry.data))
+        self.entry = entry
+        self.fragments = None
+
+    def build_xml(self, context, jinja_env=None):
+        if jinja_env is not None:
+            return super().build_xml(context, jinja_env)
+        self.current_rendering_part = self.docx._part
+        if self.fragments is not None:
+            return self.entry.loop_parts().assemble(self.fragments, context)
+        return self.entry.render_body(context)
+
+    def render_fragments(self, fragments, context=None):
+        # Render from finished loop-body XML that was already produced per receipt.
+        if self.entry.loop_parts() is None:
+            raise ValueError(f"{self.entry.path} has no single receipts loop to fill.")
+        self.fragments = fragments
+        try:
+            self.render(context or {})
+        finally:
+            self.fragments = None
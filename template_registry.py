@@ -0,0 +1,303 @@
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+import zipfile
+
+from perf import timed_call
+
+CC_ADVANCE_TEMPLATE = "CCTemplate.docx"
+SD_TEMPLATE = "SDTemplate.docx"
+
+# Seconds between stat() calls for a template that was already checked.
+CHECK_INTERVAL_SECONDS = 2.0
+
+LOOP_START_RE = re.compile(r"\{%-?\s*for\s+(\w+)\s+in\s+(\w+)\s*-?%\}")
+LOOP_END_RE = re.compile(r"\{%-?\s*endfor\s*-?%\}")
+ATTRIBUTE_TAG_RE = re.compile(r'="[^"]*\{[{%]')
+BODY_PART = "word/document.xml"
+BODY_START_RE = re.compile(r"<w:body\b[^>]*>")
+# A text element left empty by a blank value, written out as a start and end
+# tag. Matching only text elements keeps this a fast literal-prefix scan.
+EMPTY_TEXT_RE = re.compile(r"<(w:(?:t|instrText|delText))((?: [^<>]*)?)></\1>")
+# A start tag that ends a piece of body XML.
+TRAILING_START_TAG_RE = re.compile(r"<([\w:.-]+)(?:\s[^<>]*)?(?<!/)>\Z")
+
+# docxtpl (with python-docx), jinja2 and lxml are imported on first render, not
+# when the app script starts.
+# finish_xml, the shell and PreparsedDocxTemplate use docxtpl 0.20 internals
+# (resolve_listing, fix_tables, build_xml); requirements.txt pins that minor.
+
+
+def finish_xml(dst_xml):
+    from docxtpl import DocxTemplate
+
+    # Same post-processing as DocxTemplate.render_xml_part. Every step is local
+    # to a paragraph, so it can run on each receipt's fragment separately.
+    dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", dst_xml)
+    dst_xml = (
+        dst_xml.replace("{_{", "{{")
+        .replace("}_}", "}}")
+        .replace("{_%", "{%")
+        .replace("%_}", "%}")
+    )
+    dst_xml = DocxTemplate.resolve_listing(None, dst_xml)
+    # lxml serializes empty elements as <x/>; doing the same here keeps stitched
+    # output byte-identical to docxtpl's parse-and-save.
+    return EMPTY_TEXT_RE.sub(r"<\1\2/>", dst_xml)
+
+
+class LoopParts:
+    def __init__(self, prefix, item, suffix, var, items_key):
+        self.prefix = prefix
+        self.item = item
+        self.suffix = suffix
+        self.var = var
+        self.items_key = items_key
+
+    def render_item(self, item):
+        return finish_xml(self.item.render({self.var: item}))
+
+    def render(self, context):
+        fragments = [self.render_item(item) for item in context[self.items_key]]
+        return self.assemble(fragments, context)
+
+    def assemble(self, fragments, context=None):
+        context = context or {}
+        return (
+            finish_xml(self.prefix.render(context))
+            + "".join(fragments)
+            + finish_xml(self.suffix.render(context))
+        )
+
+
+def join_pieces(pieces):
+    # The receipts loop can sit inside an element, so one piece may end by
+    # opening an element that the next piece closes straight away. Collapse
+    # those joins the way finish_xml collapses empty elements inside a piece.
+    pieces = list(pieces)
+    for i in range(len(pieces) - 1):
+        left = pieces[i]
+        match = TRAILING_START_TAG_RE.search(left, max(0, len(left) - 1024))
+        if match is None:
+            continue
+        end_tag = f"</{match.group(1)}>"
+        if pieces[i + 1].startswith(end_tag):
+            pieces[i] = left[: match.end() - 1] + "/>"
+            pieces[i + 1] = pieces[i + 1][len(end_tag):]
+    return "".join(pieces)
+
+
+def split_loop(src_xml):
+    from jinja2 import Template
+
+    # A body that is exactly one top-level receipts loop can be rendered one
+    # item at a time; anything else falls back to the whole-body template.
+    starts = LOOP_START_RE.findall(src_xml)
+    if len(starts) != 1 or len(LOOP_END_RE.findall(src_xml)) != 1:
+        return None
+    start = LOOP_START_RE.search(src_xml)
+    end = LOOP_END_RE.search(src_xml)
+    item_src = src_xml[start.end():end.start()]
+    if "loop." in item_src or "{%" in src_xml[: start.start()] + src_xml[end.end():]:
+        return None
+    var, items_key = start.groups()
+    return LoopParts(
+        Template(src_xml[: start.start()]),
+        Template(item_src),
+        Template(src_xml[end.end():]),
+        var,
+        items_key,
+    )
+
+
+class TemplateEntry:
+    def __init__(self, path, stat_key, data):
+        self.path = path
+        self.stat_key = stat_key
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+        self._body_src = None
+        self._body_template = None
+        self._loop_parts = None
+        self._shell = None
+        self._lock = threading.Lock()
+
+    def body_src(self):
+        # Patch the body XML once; docxtpl would otherwise redo it for every render.
+        with self._lock:
+            if self._body_src is None:
+                from docxtpl import DocxTemplate
+
+                doc = DocxTemplate(io.BytesIO(self.data))
+                doc.init_docx()
+                src_xml = doc.patch_xml(doc.get_xml())
+                self._body_src = re.sub(r"<w:p([ >])", r"\n<w:p\1", src_xml)
+            return self._body_src
+
+    def body_template(self):
+        src_xml = self.body_src()
+        with self._lock:
+            if self._body_template is None:
+                from jinja2 import Template
+
+                self._body_template = Template(src_xml)
+            return self._body_template
+
+    def loop_parts(self):
+        src_xml = self.body_src()
+        with self._lock:
+            if self._loop_parts is None:
+                self._loop_parts = split_loop(src_xml) or False
+            return self._loop_parts or None
+
+    def shell(self):
+        # docxtpl's own output for an empty batch, plus the finished body XML
+        # around the receipts loop. With it a document is a string join and a
+        # zip copy instead of docxtpl's parse / fix_tables / serialize pass over
+        # the whole body. None when that pass could change anything: the body
+        # numbers drawing ids, tags sit inside attributes, or fix_tables would
+        # touch the tables.
+        parts = self.loop_parts()
+        if parts is None:
+            return None
+        if self._shell is None:
+            # Built outside the lock: it renders through this same entry.
+            shell = self._build_shell(parts) or False
+            with self._lock:
+                if self._shell is None:
+                    self._shell = shell
+        return self._shell or None
+
+    def _build_shell(self, parts):
+        from docxtpl import DocxTemplate
+        from lxml import etree
+
+        from template_document import PreparsedDocxTemplate
+
+        src_xml = self.body_src()
+        if "docPr" in src_xml or ATTRIBUTE_TAG_RE.search(src_xml):
+            return None
+        head = finish_xml(parts.prefix.render({}))
+        tail = finish_xml(parts.suffix.render({}))
+        probe = head + parts.render_item({}) + tail
+        try:
+            tree = etree.fromstring(probe.encode("utf-8"))
+        except etree.XMLSyntaxError:
+            return None
+        fixed = DocxTemplate.fix_tables(None, probe)
+        if etree.tostring(tree, method="c14n") != etree.tostring(fixed, method="c14n"):
+            return None
+
+        doc = PreparsedDocxTemplate(self)
+        doc.render_fragments([])
+        output = io.BytesIO()
+        doc.save(output)
+        shell_data = output.getvalue()
+
+        # head/tail hold only <w:body>; wrap them in the shell's own document
+        # element and XML declaration.
+        with zipfile.ZipFile(io.BytesIO(shell_data)) as zf:
+            doc_xml = zf.read(BODY_PART).decode("utf-8")
+        body_start = BODY_START_RE.search(doc_xml)
+        head = doc_xml[: body_start.end()] + head[BODY_START_RE.match(head).end():]
+        tail = tail[: tail.rindex("</w:body>")] + doc_xml[doc_xml.rindex("</w:body>"):]
+
+        # The stitch must write exactly the body docxtpl would. Check that on a
+        # receipt with every field blank, which leaves the most elements empty.
+        blank = parts.render_item({})
+        doc = PreparsedDocxTemplate(self)
+        doc.render_fragments([blank])
+        output = io.BytesIO()
+        doc.save(output)
+        with zipfile.ZipFile(io.BytesIO(output.getvalue())) as zf:
+            if zf.read(BODY_PART).decode("utf-8") != join_pieces([head, blank, tail]):
+                return None
+        return head, tail, shell_data
+
+    def stitch(self, fragments):
+        # Only for fragments that are well-formed XML between head and tail.
+        # Every part of the package is byte-identical to a DocxTemplate render
+        # and save of the same receipts; only the zip entry timestamps differ,
+        # as they do between any two saves.
+        head, tail, shell_data = self.shell()
+        output = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(shell_data)) as src, zipfile.ZipFile(output, "w") as dst:
+            for info in src.infolist():
+                if info.filename == BODY_PART:
+                    dst.writestr(info, join_pieces([head, *fragments, tail]).encode("utf-8"))
+                else:
+                    dst.writestr(info, src.read(info.filename))
+        return output.getvalue()
+
+    def render_body(self, context):
+        parts = self.loop_parts()
+        if parts is None or parts.items_key not in context:
+            return finish_xml(self.body_template().render(context))
+        return parts.render(context)
+
+
+class TemplateRegistry:
+    def __init__(self, check_interval=CHECK_INTERVAL_SECONDS):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    @timed_call("template_load")
+    def get(self, path):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if now - self._checked_at.get(path, float("-inf")) < self.check_interval:
+                return entry
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                entry = None
+            else:
+                stat_key = (st.st_mtime_ns, st.st_size)
+                if entry is None or entry.stat_key != stat_key:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    if entry is None or entry.digest != hashlib.sha256(data).hexdigest():
+                        entry = TemplateEntry(path, stat_key, data)
+                    else:
+                        entry.stat_key = stat_key
+
+            if entry is None:
+                self._entries.pop(path, None)
+            else:
+                self._entries[path] = entry
+            self._checked_at[path] = now
+            return entry
+
+    def exists(self, path):
+        return self.get(path) is not None
+
+    def template_bytes(self, path):
+        entry = self.get(path)
+        return entry.data if entry else None
+
+    def new_document(self, path):
+        entry = self.get(path)
+        if entry is None:
+            raise FileNotFoundError(path)
+        from template_document import PreparsedDocxTemplate
+
+        return PreparsedDocxTemplate(entry)
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._checked_at.clear()
+            else:
+                self._entries.pop(path, None)
+                self._checked_at.pop(path, None)
+
+
+registry = TemplateRegistry()
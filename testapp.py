@@ -1,155 +1,42 @@
-import io
-import os
 import re
 import uuid
-from datetime import date, datetime
+from datetime import date
 
-import pandas as pd
 import streamlit as st
-from docxtpl import DocxTemplate
-from num2words import num2words
+from streamlit_searchbox import st_searchbox
+
+import perf
+import render_jobs
+from batch_journal import journal
+from catalog import (
+    BANKS,
+    CC_PURPOSE,
+    CSS_BLOCK,
+    MONTH_LIST,
+    OTHER_PURPOSES,
+    PF_ACCOUNT,
+    PF_TAG,
+    PROCESSING_FEE_AMOUNT,
+    SD_ACCOUNT,
+    SD_TAG,
+    YEAR_OPTIONS,
+)
+from challan_allocator import AllocationError, allocator
+from formatting import amount_words, format_indian_currency, format_period_month_text
+from instrument_index import BatchInstrumentIndex, history, instrument_key
+from logo_cache import logos
+from master_data import MasterDataError, load_master_data
+from receipts import build_receipt, month_keys, month_range, remove_receipt, sd_msd_breakdown
+from rendering import DEFAULT_CHUNK_SIZE, prerender_fragments, render_docx, render_docx_shards, template_for_batch
+from template_registry import CC_ADVANCE_TEMPLATE, SD_TEMPLATE, registry as templates
 
 # --- APP CONFIGURATION ---
 st.set_page_config(page_title="Challan Master", layout="wide")
 
 # --- CUSTOM CSS ---
-CSS_BLOCK = r"""
-<style>
-[data-testid="stVerticalBlock"] > div { gap: 0.5rem !important; }
-div[data-testid="column"] button { margin-top: 28px !important; }
-
-[data-testid="stImage"] img {
-    width: 65px !important; height: 65px !important;
-    object-fit: contain !important; border-radius: 5px;
-    border: 1px solid #eee; display: block;
-    margin-left: auto; margin-right: auto;
-}
-
-.stMarkdown p {
-    font-size: 14px !important;
-    line-height: 1.6 !important;
-    margin-bottom: 0px !important;
-}
-
-.instrument-row {
-    background-color: #f9f9f9;
-    padding: 5px;
-    border-radius: 5px;
-    margin-bottom: 2px;
-}
-</style>
-"""
 st.markdown(CSS_BLOCK, unsafe_allow_html=True)
 
-# --- BANK LOGOS CONFIGURATION ---
-BANKS = [
-    {"name": "State Bank of India", "file": "logos/SBI.jpg"},
-    {"name": "HDFC Bank", "file": "logos/HDFC.jpg"},
-    {"name": "ICICI Bank", "file": "logos/ICICI Bank.jpg"},
-    {"name": "Axis Bank", "file": "logos/Axis Bank.jpg"},
-    {"name": "Indian Bank", "file": "logos/Indian Bank.jpg"},
-    {"name": "Canara Bank", "file": "logos/Canara.jpg"},
-    {"name": "Bank of Baroda", "file": "logos/Bank of Baroda.jpg"},
-    {"name": "Union Bank of India", "file": "logos/Union Bank of India.jpg"},
-    {"name": "Karur Vysya Bank", "file": "logos/KVB.jpg"},
-    {"name": "Yes Bank", "file": "logos/Yes Bank.jpg"},
-    {"name": "IDFC First Bank", "file": "logos/IDFC First Bank.jpg"},
-    {"name": "Bandhan Bank", "file": "logos/Bandhan Bank.jpg"},
-    {"name": "Kotak Mahindra Bank", "file": "logos/KMB.jpg"},
-    {"name": "South Indian Bank", "file": "logos/South Indian Bank.jpg"},
-    {"name": "Central Bank of India", "file": "logos/Central Bank of India.jpg"},
-    {"name": "Indian Overseas Bank", "file": "logos/Indian Overseas Bank.jpg"},
-    {"name": "Bank of India", "file": "logos/Bank of India.jpg"},
-    {"name": "UCO Bank", "file": "logos/UCO Bank.jpg"},
-    {"name": "City Union Bank", "file": "logos/City Union Bank.jpg"},
-    {"name": "Deutsche Bank", "file": "logos/Deutsche Bank.jpg"},
-    {"name": "Equitas Bank", "file": "logos/Equitas Bank.jpg"},
-    {"name": "IDBI Bank", "file": "logos/IDBI Bank.jpg"},
-    {
-        "name": "The Hongkong and Shanghai Banking Corporation",
-        "file": "logos/HSBC.jpg",
-    },
-    {
-        "name": "Tamilnad Mercantile Bank",
-        "file": "logos/Tamilnad Mercantile Bank.jpg",
-    },
-    {"name": "Karnataka Bank", "file": "logos/Karnataka Bank.jpg"},
-    {"name": "CSB Bank", "file": "logos/CSB Bank.jpg"},
-    {"name": "Punjab National Bank", "file": "logos/Punjab National Bank.jpg"},
-    {"name": "Federal Bank", "file": "logos/Federal Bank.jpg"},
-]
-
-CC_ADVANCE_TEMPLATE = "CCTemplate.docx"
-SD_TEMPLATE = "SDTemplate.docx"
-
-OTHER_PURPOSES = [
-    "Advance Payment",
-    "Advance Security Deposit (ASD)",
-    "Security Deposit and Meter Security Deposit (SD and MSD)",
-    "Processing Fee",
-]
-
-MONTH_LIST = [
-    "January",
-    "February",
-    "March",
-    "April",
-    "May",
-    "June",
-    "July",
-    "August",
-    "September",
-    "October",
-    "November",
-    "December",
-]
-MONTH_ABBR = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-YEAR_OPTIONS = [2026, 2025]
-
-
-def format_indian_currency(number):
-    try:
-        main = str(int(float(number)))
-        if len(main) <= 3:
-            return main
-        last_three = main[-3:]
-        remaining = main[:-3]
-        res = ""
-        while len(remaining) > 2:
-            res = "," + remaining[-2:] + res
-            remaining = remaining[:-2]
-        if remaining:
-            res = remaining + res
-        return f"{res},{last_three}"
-    except Exception:
-        return "0"
-
-
-def amount_words(number):
-    return (
-        num2words(int(number), lang="en_IN")
-        .replace(",", "")
-        .replace(" And ", " and ")
-        .title()
-        .replace(" And ", " and ")
-    )
-
-
-def format_period_month_text(target_months):
-    year_to_months = {}
-    for month_name, year in target_months:
-        year_to_months.setdefault(year, []).append(month_name)
-
-    parts = []
-    for year, months in year_to_months.items():
-        parts.append(f"{', '.join(months)} - {year}")
-
-    return " and ".join(parts)
-
-
-class SafeReceipt(dict):
-    def __getattr__(self, key):
-        return self.get(key, "")
+BATCH_PAGE_SIZES = [10, 25, 50, 100]
 
 
 @st.dialog("Select Bank", width="medium")
@@ -158,8 +45,9 @@ def bank_selection_dialog():
     cols = st.columns(7, gap="small")
     for i, bank in enumerate(BANKS):
         with cols[i % 7]:
-            if os.path.exists(bank["file"]):
-                st.image(bank["file"])
+            logo = logos.get(bank["file"])
+            if logo is not None:
+                st.image(logo)
             else:
                 st.caption(bank["name"])
             if st.button("Select", key=f"btn_{i}"):
@@ -168,7 +56,11 @@ def bank_selection_dialog():
 
 
 @st.dialog("Edit Amount")
-def edit_amount_dialog(index):
+def edit_amount_dialog(receipt_id):
+    index = receipt_index(receipt_id)
+    if index is None:
+        st.error("Receipt no longer in batch.")
+        return
     rec = st.session_state.all_receipts[index]
     current_val = rec["amount"].replace(",", "")
     new_amt_str = st.text_input("Enter New Amount", value=current_val)
@@ -176,125 +68,131 @@ def edit_amount_dialog(index):
     if st.button("Save Changes"):
         try:
             new_amt = int(new_amt_str)
-            st.session_state.all_receipts[index]["amount"] = format_indian_currency(new_amt)
-            st.session_state.all_receipts[index]["words"] = amount_words(new_amt)
+            changes = {"amount": format_indian_currency(new_amt), "words": amount_words(new_amt)}
+            st.session_state.all_receipts[index].update(changes)
+            journal.record_edit(st.session_state.batch_id, receipt_id, changes)
+            prerender_fragments(
+                template_for_batch(st.session_state.challan_type, st.session_state.all_receipts),
+                [st.session_state.all_receipts[index]],
+            )
             st.rerun()
         except ValueError:
             st.error("Please enter a valid whole number.")
 
 
-if "all_receipts" not in st.session_state:
-    st.session_state.all_receipts = []
-if "locked" not in st.session_state:
-    st.session_state.locked = False
-if "selected_bank" not in st.session_state:
-    st.session_state.selected_bank = ""
-if "show_batch" not in st.session_state:
-    st.session_state.show_batch = False
-if "is_period" not in st.session_state:
-    st.session_state.is_period = False
-if "consumer_key" not in st.session_state:
-    st.session_state.consumer_key = 0
-if "temp_instruments" not in st.session_state:
+def restore_batch(batch_id):
+    batch = journal.load_batch(batch_id)
+    if batch is None:
+        return False
+    if batch["status"] == "finalized":
+        # Its numbers are issued; reopening it would issue them twice.
+        st.query_params.pop("batch", None)
+        return False
+    receipts = batch["receipts"]
+    st.session_state.locked = True
+    st.session_state.batch_id = batch_id
+    st.session_state.challan_type = batch["challan_type"]
+    st.session_state.start_no = batch["start_no"]
+    st.session_state.formatted_pdate = batch["pdate"]
+    st.session_state.all_receipts = receipts
+    st.session_state.instrument_index = BatchInstrumentIndex(receipts)
     st.session_state.temp_instruments = []
-if "challan_type" not in st.session_state:
-    st.session_state.challan_type = "C. C"
-if "other_form_key" not in st.session_state:
-    st.session_state.other_form_key = 0
-if "batch_purpose" not in st.session_state:
     st.session_state.batch_purpose = ""
-
-with st.sidebar:
-    st.header("⚙️ Configuration")
-    challan_type = st.radio(
-        "Challan Type",
-        ["C. C", "OTHER"],
-        index=0 if st.session_state.challan_type == "C. C" else 1,
-        disabled=st.session_state.locked,
-    )
-
-    s_challan = st.text_input("Starting Challan", disabled=st.session_state.locked)
-    s_pdate = st.date_input("Challan Date", disabled=st.session_state.locked)
-
-    if s_challan and not s_challan.isdigit():
-        st.error("Challan Number must contain Numbers only.")
-
-    st.divider()
-
-    template_bytes = None
-
-    if challan_type == "C. C":
-        if os.path.exists(CC_ADVANCE_TEMPLATE):
-            st.success("✅ C.C Template Loaded")
-            with open(CC_ADVANCE_TEMPLATE, "rb") as f:
-                template_bytes = f.read()
-        else:
-            st.error(f"❌ {CC_ADVANCE_TEMPLATE} Missing!")
+    if batch["challan_type"] == "OTHER" and receipts:
+        st.session_state.batch_purpose = receipts[0]["selected_purpose"]
+    st.query_params["batch"] = batch_id
+    if batch["status"] != "open":
+        journal.set_status(batch_id, "open")
+    st.session_state.allocation_error = ""
+    try:
+        allocator.reserve(batch_id, batch["challan_type"], batch["start_no"], len(receipts))
+    except AllocationError as exc:
+        st.session_state.allocation_error = str(exc)
+    return True
+
+
+def resume_label(batch):
+    return f"{batch['challan_type']} from {batch['start_no']} ({batch['pdate']}) - {batch['receipt_count']} receipts"
+
+
+def mark_batch_finalized():
+    journal.set_status(st.session_state.batch_id, "finalized")
+    history.record_batch(st.session_state.batch_id, st.session_state.all_receipts)
+    allocator.finalize(st.session_state.batch_id, len(st.session_state.all_receipts))
+    # A reload after the download must not bring the finalized batch back.
+    st.query_params.pop("batch", None)
+
+
+def receipt_index(receipt_id):
+    for i, rec in enumerate(st.session_state.all_receipts):
+        if rec["id"] == receipt_id:
+            return i
+    return None
+
+
+def duplicate_instrument_note(inst, position):
+    key = instrument_key(inst["bank"], inst["type"], inst["no"], inst["date"])
+    label = f"{inst['type']} {inst['no']} dated {inst['date']}"
+    for other in st.session_state.temp_instruments[:position]:
+        if instrument_key(other["bank"], other["type"], other["no"], other["date"]) == key:
+            return f"{label} is entered twice for this receipt."
+    owners = st.session_state.instrument_index.owners(key)
+    if owners:
+        challans = ", ".join(str(r["challan"]) for r in owners)
+        return f"{label} is already on Challan {challans} in this batch."
+    issued = history.find(key, exclude_batch=st.session_state.batch_id)
+    if issued is not None:
+        return f"{label} was already used on Challan {issued[0]} dated {issued[1]}."
+    return ""
+
+
+def delete_receipt(receipt_id):
+    i = receipt_index(receipt_id)
+    if i is None:
+        return
+    st.session_state.instrument_index.remove(st.session_state.all_receipts[i])
+    remove_receipt(st.session_state.all_receipts, receipt_id)
+    journal.record_delete(st.session_state.batch_id, receipt_id)
+    if not st.session_state.all_receipts:
+        st.session_state.batch_purpose = ""
+        st.session_state.other_form_key += 1
+
+
+@st.fragment(run_every=1)
+def render_job_progress(job_id):
+    job = render_jobs.get_job(job_id)
+    if job is None or not job.running:
+        st.rerun()
+    if job.done < job.total:
+        st.progress(job.done / job.total, text=f"Rendering... {job.done} of {job.total} receipts")
     else:
-        cc_ok = os.path.exists(CC_ADVANCE_TEMPLATE)
-        sd_ok = os.path.exists(SD_TEMPLATE)
-
-        if cc_ok:
-            st.success("✅ CCTemplate Loaded (for Advance Payment)")
-        else:
-            st.error(f"❌ {CC_ADVANCE_TEMPLATE} Missing!")
-
-        if sd_ok:
-            st.success("✅ SDTemplate Loaded (for ASD / SD & MSD / Processing Fee)")
-        else:
-            st.error(f"❌ {SD_TEMPLATE} Missing!")
+        st.progress(1.0, text="Assembling Word file...")
 
-    data_file = st.file_uploader("Upload Master Data (.xlsx)", type=["xlsx"])
 
-    if not st.session_state.locked:
-        if st.button("Confirm Setup", type="primary"):
-            if not s_challan or not s_challan.isdigit():
-                st.error("Enter a valid Numeric Challan Number.")
-            elif challan_type == "C. C" and not template_bytes:
-                st.error("C.C template not loaded.")
-            elif challan_type == "OTHER" and (not os.path.exists(CC_ADVANCE_TEMPLATE) or not os.path.exists(SD_TEMPLATE)):
-                st.error("Load both CCTemplate.docx and SDTemplate.docx.")
-            elif not data_file:
-                st.error("Upload Master Data.")
-            else:
-                st.session_state.locked = True
-                st.session_state.challan_type = challan_type
-                st.session_state.start_no = int(s_challan)
-                st.session_state.formatted_pdate = s_pdate.strftime("%d.%m.%Y")
-                st.rerun()
-    else:
-        if st.button("Reset Session"):
-            st.session_state.locked = False
-            st.session_state.all_receipts = []
-            st.session_state.temp_instruments = []
-            st.session_state.selected_bank = ""
-            st.session_state.other_form_key = 0
-            st.session_state.batch_purpose = ""
-            st.rerun()
+def consumer_searchbox(master):
+    # Picking a match fills the Consumer Number box below, which does the lookup.
+    number_key = f"consumer_{st.session_state.consumer_key}"
 
-if st.session_state.locked:
-    curr_count = len(st.session_state.all_receipts)
-    next_no = st.session_state.start_no + curr_count
+    def search(term):
+        return [(f"{number} - {name}", number) for number, name in master.search_consumers(term)]
 
-    if st.session_state.challan_type == "C. C":
-        m1, m2, m3, m4 = st.columns(4)
-        m1.metric("First Challan", st.session_state.start_no)
-        m2.metric("Current No.", next_no)
-        m3.metric("Date", st.session_state.formatted_pdate)
-        m4.metric("Entered", curr_count)
-    else:
-        m1, m2 = st.columns(2)
-        m1.metric("Current No.", next_no)
-        m2.metric("Date", st.session_state.formatted_pdate)
+    def pick(number):
+        st.session_state[number_key] = number
 
-    try:
-        df = pd.read_excel(data_file, sheet_name="BILL")
-    except Exception:
-        st.error("Sheet 'BILL' not found.")
-        st.stop()
+    st_searchbox(
+        search,
+        placeholder="Type a consumer name or number",
+        label="Find Consumer",
+        key=f"consumer_search_{st.session_state.consumer_key}",
+        submit_function=pick,
+        rerun_scope="fragment",
+    )
 
-    st.divider()
 
+@st.fragment
+def consumer_search_panel(master):
+    # Fragment reruns run in a fresh thread; keep this session's timings bound.
+    perf.bind_session(st.session_state.perf)
     has_active_instruments = len(st.session_state.temp_instruments) > 0
     row = None
     total_amt = None
@@ -311,7 +209,7 @@ if st.session_state.locked:
             toggle_label = "Single Month Mode" if not st.session_state.is_period else "Period Mode"
             if st.button(toggle_label, disabled=has_active_instruments):
                 st.session_state.is_period = not st.session_state.is_period
-                st.rerun()
+                st.rerun(scope="fragment")
 
         if not st.session_state.is_period:
             c1, c2 = st.columns(2)
@@ -341,20 +239,10 @@ if st.session_state.locked:
                     "To Year", options=YEAR_OPTIONS, index=0, disabled=has_active_instruments
                 )
 
-            start_date = datetime(f_year, MONTH_LIST.index(f_month) + 1, 1)
-            end_date = datetime(t_year, MONTH_LIST.index(t_month) + 1, 1)
-
             target_months = []
 
-            if start_date <= end_date:
-                curr = start_date
-                while curr <= end_date:
-                    target_months.append((MONTH_LIST[curr.month - 1], curr.year))
-                    curr = (
-                        datetime(curr.year + 1, 1, 1)
-                        if curr.month == 12
-                        else datetime(curr.year, curr.month + 1, 1)
-                    )
+            if (f_year, MONTH_LIST.index(f_month)) <= (t_year, MONTH_LIST.index(t_month)):
+                target_months = month_range(f_month, f_year, t_month, t_year)
                 display_month_text = format_period_month_text(target_months)
             else:
                 st.error("'From' date must be before 'To' date.")
@@ -362,6 +250,8 @@ if st.session_state.locked:
             if not target_months:
                 st.warning("Selected Month-Year range is empty.")
 
+        if not has_active_instruments:
+            consumer_searchbox(master)
         search_num = st.text_input(
             "Enter Consumer Number",
             max_chars=3,
@@ -372,41 +262,21 @@ if st.session_state.locked:
         if search_num and not re.match(r"^\d*$", search_num):
             st.error("Consumer Number must contain numbers only.")
         elif search_num and len(search_num) == 3 and re.match(r"^\d{3}$", search_num):
-            result = df[df["Consumer Number"].astype(str).str.zfill(3) == search_num]
+            row = master.find_consumer(search_num)
 
-            if result.empty:
+            if row is None:
                 st.error("Consumer not found in Master Data.")
             else:
-                row = result.iloc[0]
-                total_amt = 0
-                month_found = False
-
-                for m, y in target_months:
-                    t_abbr = f"{MONTH_ABBR[MONTH_LIST.index(m)]}-{str(y)[2:]}"
-                    t_col = next(
-                        (
-                            col
-                            for col in df.columns
-                            if str(col).strip() == t_abbr
-                            or (
-                                isinstance(col, (datetime, pd.Timestamp))
-                                and col.month == MONTH_LIST.index(m) + 1
-                                and col.year == y
-                            )
-                        ),
-                        None,
-                    )
-
-                    if t_col is not None:
-                        month_found = True
-                        total_amt += row[t_col] if not pd.isna(row[t_col]) else 0
+                if master.duplicate_count(search_num) > 1:
+                    st.warning(f"Consumer {search_num} appears {master.duplicate_count(search_num)} times; using the first row.")
+                month_found, total_amt = master.period_total(search_num, month_keys(target_months))
 
                 if not month_found:
                     st.error("Selected Month-Year column not found in Master Data.")
                 elif total_amt <= 0:
                     st.warning("Amount is zero for selected Month-Year.")
                 else:
-                    purpose_value = "C. C. Charges"
+                    purpose_value = CC_PURPOSE
                     description_value = display_month_text
                     st.success(
                         f"**Found:** {row['Name']} | **Total Amt:** ₹{format_indian_currency(total_amt)}"
@@ -479,8 +349,8 @@ if st.session_state.locked:
                 st.error("Amount must be a valid whole number.")
             else:
                 total_amt = None
-            tag_value = "SD"
-            account_value = "8336 – CIVIL DEPOSITS – 101 – SECURITY DEPOSITS"
+            tag_value = SD_TAG
+            account_value = SD_ACCOUNT
 
         elif selected_other_purpose == "Security Deposit and Meter Security Deposit (SD and MSD)":
             sd_desc_options = [
@@ -507,8 +377,8 @@ if st.session_state.locked:
                 description_value = f"{sd_desc_choice} {desc_value_4d} KVA".strip()
 
             purpose_value = description_value
-            tag_value = "SD"
-            account_value = "8336 – CIVIL DEPOSITS – 101 – SECURITY DEPOSITS"
+            tag_value = SD_TAG
+            account_value = SD_ACCOUNT
 
             s1, s2 = st.columns(2)
             with s1:
@@ -520,10 +390,7 @@ if st.session_state.locked:
                 sd_amount = int(sd_amount_str)
                 msd_amount = int(msd_amount_str)
                 total_amt = sd_amount + msd_amount
-                breakdown_value = (
-                    f"[S.D     : {format_indian_currency(sd_amount)}]\n"
-                    f"[M.S.D : {format_indian_currency(msd_amount)}]"
-                )
+                breakdown_value = sd_msd_breakdown(sd_amount, msd_amount)
             else:
                 total_amt = None
                 if sd_amount_str or msd_amount_str:
@@ -553,9 +420,9 @@ if st.session_state.locked:
                 description_value = f"{proc_desc_choice} {desc_value_4d} KVA".strip()
 
             purpose_value = description_value
-            tag_value = "CCC/PF"
-            account_value = "0801 – Power 05 – Transmission and Distribution (101) Sale of Power"
-            total_amt = 20000
+            tag_value = PF_TAG
+            account_value = PF_ACCOUNT
+            total_amt = PROCESSING_FEE_AMOUNT
             st.info("Processing Fee amount is fixed at ₹20,000")
 
         if selected_other_purpose in [
@@ -581,6 +448,7 @@ if st.session_state.locked:
                 "Consumer Number": "NEW",
             }
         else:
+            consumer_searchbox(master)
             search_num = st.text_input(
                 "Enter Consumer Number",
                 max_chars=3,
@@ -589,11 +457,11 @@ if st.session_state.locked:
             if search_num and not re.match(r"^\d*$", search_num):
                 st.error("Consumer Number must contain numbers only.")
             elif search_num and len(search_num) == 3 and re.match(r"^\d{3}$", search_num):
-                result = df[df["Consumer Number"].astype(str).str.zfill(3) == search_num]
-                if result.empty:
+                row = master.find_consumer(search_num)
+                if row is None:
                     st.error("Consumer not found in Master Data.")
-                else:
-                    row = result.iloc[0]
+                elif master.duplicate_count(search_num) > 1:
+                    st.warning(f"Consumer {search_num} appears {master.duplicate_count(search_num)} times; using the first row.")
 
         if row is not None:
             if is_new_consumer:
@@ -601,165 +469,453 @@ if st.session_state.locked:
             else:
                 st.success(f"**Found:** {row['Name']} | **Purpose:** {purpose_value}")
 
+    draft = None
     if row is not None and total_amt is not None:
-        b_col1, b_col2 = st.columns([0.9, 0.1], vertical_alignment="bottom")
-        with b_col1:
-            bank_name = st.text_input(
-                "Bank Name", value=st.session_state.selected_bank, disabled=has_active_instruments
-            )
-        with b_col2:
-            if st.button("🔍 Select", disabled=has_active_instruments):
-                bank_selection_dialog()
-
-        with st.expander("💳 Add Payment Details", expanded=True):
-            restricted_mode = None
-            if st.session_state.temp_instruments:
-                restricted_mode = st.session_state.temp_instruments[0]["type"]
-
-            with st.form("instrument_form", clear_on_submit=True):
-                f1, f2, f3 = st.columns(3)
-                with f1:
-                    if restricted_mode:
-                        st.markdown("🔒 Locked")
-                        st.info(f"Mode: {restricted_mode}")
-                        i_type = restricted_mode
-                    else:
-                        i_type = st.selectbox("Type", ["Cheque", "Demand Draft"])
-                with f2:
-                    i_no = st.text_input("No.", max_chars=6)
-                with f3:
-                    i_date = st.date_input("Date")
-
-                if st.form_submit_button("➕ Add Payment"):
-                    if bank_name and re.match(r"^\d{6}$", i_no):
-                        st.session_state.temp_instruments.append(
-                            {
-                                "bank": bank_name,
-                                "type": i_type,
-                                "no": i_no,
-                                "date": i_date.strftime("%d.%m.%Y"),
-                            }
-                        )
-                        st.rerun()
-                    else:
-                        st.error("Check Bank Name and Cheque/DD No.")
-
-            for idx, inst in enumerate(st.session_state.temp_instruments):
-                cols = st.columns([2.5, 2, 2, 2, 0.5])
-                cols[0].write(f"🏦 {inst['bank']}")
-                cols[1].write(f"📄 {inst['type']}")
-                cols[2].write(f"🔢 {inst['no']}")
-                cols[3].write(f"📅 {inst['date']}")
-                if cols[4].button("🗑️", key=f"del_tmp_{idx}"):
-                    st.session_state.temp_instruments.pop(idx)
-                    st.rerun()
+        draft_error = ""
+        if st.session_state.challan_type == "C. C":
+            selected_purpose = "C. C"
+            month_value = display_month_text
+        else:
+            selected_purpose = selected_other_purpose
+            month_value = description_value
+            if not description_value.strip() and selected_other_purpose != "Advance Payment":
+                draft_error = "Description is required for selected purpose."
+            elif require_kva_value and not re.match(r"^\d{1,4}$", desc_value_4d):
+                draft_error = "Please enter a valid 1 to 4 digit value."
+            elif is_new_consumer and not new_consumer_name.strip():
+                draft_error = "Please enter Consumer Name for New Consumer."
+        draft = {
+            "row": row,
+            "total_amt": total_amt,
+            "purpose": purpose_value,
+            "selected_purpose": selected_purpose,
+            "description": description_value,
+            "tag": tag_value,
+            "account": account_value,
+            "breakdown": breakdown_value,
+            "month": month_value,
+            "error": draft_error,
+        }
+    st.session_state.draft = draft
+
+    # The payment panel only exists while a receipt is ready; when that flips
+    # during a fragment rerun, the panel needs a full rerun to appear or vanish.
+    if st.session_state.payment_ready is not None and st.session_state.payment_ready != (draft is not None):
+        st.rerun()
+
+
+@st.fragment
+def payment_panel():
+    perf.bind_session(st.session_state.perf)
+    draft = st.session_state.draft
+    st.session_state.payment_ready = draft is not None
+    if draft is None:
+        return
+
+    has_active_instruments = len(st.session_state.temp_instruments) > 0
+    b_col1, b_col2 = st.columns([0.9, 0.1], vertical_alignment="bottom")
+    with b_col1:
+        bank_name = st.text_input(
+            "Bank Name", value=st.session_state.selected_bank, disabled=has_active_instruments
+        )
+    with b_col2:
+        if st.button("🔍 Select", disabled=has_active_instruments):
+            bank_selection_dialog()
+
+    with st.expander("💳 Add Payment Details", expanded=True):
+        restricted_mode = None
+        if st.session_state.temp_instruments:
+            restricted_mode = st.session_state.temp_instruments[0]["type"]
+
+        with st.form("instrument_form", clear_on_submit=True):
+            f1, f2, f3 = st.columns(3)
+            with f1:
+                if restricted_mode:
+                    st.markdown("🔒 Locked")
+                    st.info(f"Mode: {restricted_mode}")
+                    i_type = restricted_mode
+                else:
+                    i_type = st.selectbox("Type", ["Cheque", "Demand Draft"])
+            with f2:
+                i_no = st.text_input("No.", max_chars=6)
+            with f3:
+                i_date = st.date_input("Date")
+
+            if st.form_submit_button("➕ Add Payment"):
+                if bank_name and re.match(r"^\d{6}$", i_no):
+                    st.session_state.temp_instruments.append(
+                        {
+                            "bank": bank_name,
+                            "type": i_type,
+                            "no": i_no,
+                            "date": i_date.strftime("%d.%m.%Y"),
+                        }
+                    )
+                    rerun_after_instrument_change()
+                else:
+                    st.error("Check Bank Name and Cheque/DD No.")
+
+        for idx, inst in enumerate(st.session_state.temp_instruments):
+            cols = st.columns([2.5, 2, 2, 2, 0.5])
+            cols[0].write(f"🏦 {inst['bank']}")
+            cols[1].write(f"📄 {inst['type']}")
+            cols[2].write(f"🔢 {inst['no']}")
+            cols[3].write(f"📅 {inst['date']}")
+            if cols[4].button("🗑️", key=f"del_tmp_{idx}"):
+                st.session_state.temp_instruments.pop(idx)
+                rerun_after_instrument_change()
+            duplicate_note = duplicate_instrument_note(inst, idx)
+            if duplicate_note:
+                st.warning(f"⚠️ {duplicate_note}")
+
+    if st.button("🚀 Add to Batch", type="primary"):
+        if not st.session_state.temp_instruments:
+            st.error("Add at least One Payment Details.")
+        elif not bank_name:
+            st.error("Bank Name is required.")
+        elif draft["error"]:
+            st.error(draft["error"])
+        else:
+            add_to_batch(draft, bank_name)
+
+
+def add_to_batch(draft, bank_name):
+    challan = st.session_state.start_no + len(st.session_state.all_receipts)
+    try:
+        allocator.ensure(st.session_state.batch_id, st.session_state.challan_type, st.session_state.start_no, challan)
+    except AllocationError as exc:
+        st.error(str(exc))
+        return
+    receipt = build_receipt(
+        challan,
+        st.session_state.formatted_pdate,
+        draft["row"],
+        st.session_state.temp_instruments,
+        bank_name,
+        draft["total_amt"],
+        purpose=draft["purpose"],
+        selected_purpose=draft["selected_purpose"],
+        description=draft["description"],
+        tag=draft["tag"],
+        account=draft["account"],
+        breakdown=draft["breakdown"],
+        month=draft["month"],
+    )
+    st.session_state.all_receipts.append(receipt)
+    st.session_state.instrument_index.add(receipt)
+    journal.record_add(st.session_state.batch_id, receipt)
+    prerender_fragments(template_for_batch(st.session_state.challan_type, st.session_state.all_receipts), [receipt])
+    st.session_state.temp_instruments = []
+    st.session_state.selected_bank = ""
+    st.session_state.is_period = False
+    if st.session_state.challan_type == "OTHER" and not st.session_state.batch_purpose:
+        st.session_state.batch_purpose = draft["selected_purpose"]
+    if st.session_state.challan_type == "OTHER":
+        st.session_state.other_form_key += 1
+    st.session_state.consumer_key += 1
+    st.rerun()
+
+
+def rerun_after_instrument_change():
+    # The first instrument locks the consumer search inputs and removing the
+    # last one unlocks them; any other change only touches this panel.
+    if len(st.session_state.temp_instruments) > 1:
+        st.rerun(scope="fragment")
+    st.rerun()
+
+
+@st.fragment
+@perf.timed_call("batch_table")
+def batch_table():
+    perf.bind_session(st.session_state.perf)
+    if not st.checkbox("👁️ View Batch Table", value=st.session_state.show_batch):
+        return
+    st.session_state.show_batch = True
+    receipts = st.session_state.all_receipts
+    p1, p2, p3 = st.columns([0.2, 0.2, 0.6], vertical_alignment="bottom")
+    with p1:
+        page_size = st.selectbox("Rows per Page", BATCH_PAGE_SIZES, index=1, key="batch_page_size")
+    page_count = max(1, -(-len(receipts) // page_size))
+    if st.session_state.get("batch_page", 1) > page_count:
+        st.session_state.batch_page = page_count
+    with p2:
+        page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key="batch_page")
+    first = (page - 1) * page_size
+    page_receipts = receipts[first:first + page_size]
+    with p3:
+        st.caption(f"Showing {first + 1}–{first + len(page_receipts)} of {len(receipts)}")
+
+    t_head = st.columns([0.7, 2.2, 1.7, 1.2, 1.2, 2, 1.1])
+    t_head[0].write("**No.**")
+    t_head[1].write("**Consumer**")
+    t_head[2].write("**Amount**")
+    t_head[3].write("**Mode**")
+    t_head[4].write("**No.**")
+    t_head[5].write("**Purpose**")
+    t_head[6].write("**Actions**")
+    for rec in page_receipts:
+        tcol = st.columns([0.7, 2.2, 1.7, 1.2, 1.2, 2, 1.1])
+        tcol[0].write(rec["challan"])
+        tcol[1].write(rec["name"])
+        tcol[2].write(f"₹{rec['amount']}")
+        tcol[3].write(rec["pay_type"])
+        tcol[4].write(rec["pay_no"])
+        tcol[5].write(rec.get("purpose", "C. C"))
+        with tcol[6]:
+            s1, s2 = st.columns(2)
+            if s1.button("✏️", key=f"e_{rec['id']}"):
+                edit_amount_dialog(rec["id"])
+            if s2.button("🗑️", key=f"d_{rec['id']}"):
+                delete_receipt(rec["id"])
+                st.rerun()
+
+
+if "all_receipts" not in st.session_state:
+    st.session_state.all_receipts = []
+if "locked" not in st.session_state:
+    st.session_state.locked = False
+if "selected_bank" not in st.session_state:
+    st.session_state.selected_bank = ""
+if "show_batch" not in st.session_state:
+    st.session_state.show_batch = False
+if "is_period" not in st.session_state:
+    st.session_state.is_period = False
+if "consumer_key" not in st.session_state:
+    st.session_state.consumer_key = 0
+if "temp_instruments" not in st.session_state:
+    st.session_state.temp_instruments = []
+if "challan_type" not in st.session_state:
+    st.session_state.challan_type = "C. C"
+if "other_form_key" not in st.session_state:
+    st.session_state.other_form_key = 0
+if "batch_purpose" not in st.session_state:
+    st.session_state.batch_purpose = ""
+if "render_job_id" not in st.session_state:
+    st.session_state.render_job_id = ""
+if "draft" not in st.session_state:
+    st.session_state.draft = None
+if "allocation_error" not in st.session_state:
+    st.session_state.allocation_error = ""
+if "batch_id" not in st.session_state:
+    st.session_state.batch_id = ""
+    # A reload keeps the URL, so an in-progress batch comes back from the journal.
+    if "batch" in st.query_params:
+        restore_batch(st.query_params["batch"])
+if "instrument_index" not in st.session_state:
+    st.session_state.instrument_index = BatchInstrumentIndex()
+if "perf" not in st.session_state:
+    st.session_state.perf = perf.Timings(uuid.uuid4().hex)
+perf.bind_session(st.session_state.perf)
+
+with st.sidebar:
+    st.header("⚙️ Configuration")
+    challan_type = st.radio(
+        "Challan Type",
+        ["C. C", "OTHER"],
+        index=0 if st.session_state.challan_type == "C. C" else 1,
+        disabled=st.session_state.locked,
+    )
+
+    operator_id = st.text_input("Operator ID", key="operator_id", disabled=st.session_state.locked).strip()
+    s_challan = st.text_input("Starting Challan", disabled=st.session_state.locked)
+    s_pdate = st.date_input("Challan Date", disabled=st.session_state.locked)
+
+    if s_challan and not s_challan.isdigit():
+        st.error("Challan Number must contain Numbers only.")
+
+    st.divider()
+
+    cc_ok = templates.exists(CC_ADVANCE_TEMPLATE)
+    sd_ok = templates.exists(SD_TEMPLATE)
+
+    if challan_type == "C. C":
+        if cc_ok:
+            st.success("✅ C.C Template Loaded")
+        else:
+            st.error(f"❌ {CC_ADVANCE_TEMPLATE} Missing!")
+    else:
+        if cc_ok:
+            st.success("✅ CCTemplate Loaded (for Advance Payment)")
+        else:
+            st.error(f"❌ {CC_ADVANCE_TEMPLATE} Missing!")
+
+        if sd_ok:
+            st.success("✅ SDTemplate Loaded (for ASD / SD & MSD / Processing Fee)")
+        else:
+            st.error(f"❌ {SD_TEMPLATE} Missing!")
 
-        if st.button("🚀 Add to Batch", type="primary"):
-            if not st.session_state.temp_instruments:
-                st.error("Add at least One Payment Details.")
-            elif not bank_name:
-                st.error("Bank Name is required.")
-            elif st.session_state.challan_type == "OTHER" and not description_value.strip() and selected_other_purpose != "Advance Payment":
-                st.error("Description is required for selected purpose.")
-            elif st.session_state.challan_type == "OTHER" and require_kva_value and not re.match(r"^\d{1,4}$", desc_value_4d):
-                st.error("Please enter a valid 1 to 4 digit value.")
-            elif st.session_state.challan_type == "OTHER" and is_new_consumer and not new_consumer_name.strip():
-                st.error("Please enter Consumer Name for New Consumer.")
-            elif st.session_state.challan_type == "OTHER" and selected_other_purpose not in [
-                "Processing Fee",
-                "Security Deposit and Meter Security Deposit (SD and MSD)",
-            ] and total_amt is None:
-                st.error("Please enter a valid Amount.")
-            elif st.session_state.challan_type == "OTHER" and selected_other_purpose == "Security Deposit and Meter Security Deposit (SD and MSD)" and total_amt is None:
-                st.error("Please enter valid SD Amount and MSD Amount.")
+    data_file = st.file_uploader("Upload Master Data (.xlsx)", type=["xlsx"])
+
+    if not st.session_state.locked:
+        if st.button("Confirm Setup", type="primary"):
+            if not s_challan or not s_challan.isdigit():
+                st.error("Enter a valid Numeric Challan Number.")
+            elif challan_type == "C. C" and not cc_ok:
+                st.error("C.C template not loaded.")
+            elif challan_type == "OTHER" and (not cc_ok or not sd_ok):
+                st.error("Load both CCTemplate.docx and SDTemplate.docx.")
+            elif not data_file:
+                st.error("Upload Master Data.")
             else:
-                receipt = {
-                    "id": str(uuid.uuid4()),
-                    "challan": next_no,
-                    "pdate": st.session_state.formatted_pdate,
-                    "name": row["Name"],
-                    "num": row["Consumer Number"],
-                    "purpose": purpose_value,
-                    "selected_purpose": selected_other_purpose if st.session_state.challan_type == "OTHER" else "C. C",
-                    "description": description_value,
-                    "tag": tag_value,
-                    "account": account_value,
-                    "breakdown": breakdown_value,
-                    "amount": format_indian_currency(total_amt),
-                    "words": amount_words(total_amt),
-                    "pay_type": st.session_state.temp_instruments[0]["type"],
-                    "pay_no": ", ".join([i["no"] for i in st.session_state.temp_instruments]),
-                    "bank": bank_name,
-                    "date": ", ".join(list(set([i["date"] for i in st.session_state.temp_instruments]))),
-                }
-                if st.session_state.challan_type == "C. C":
-                    receipt["month"] = display_month_text
+                batch_id = str(uuid.uuid4())
+                try:
+                    allocator.reserve(batch_id, challan_type, int(s_challan))
+                except AllocationError as exc:
+                    st.error(f"{exc} Check the Starting Challan.")
                 else:
-                    receipt["month"] = description_value
-                st.session_state.all_receipts.append(receipt)
-                st.session_state.temp_instruments = []
-                st.session_state.selected_bank = ""
-                st.session_state.is_period = False
-                if st.session_state.challan_type == "OTHER" and not st.session_state.batch_purpose:
-                    st.session_state.batch_purpose = selected_other_purpose
-                if st.session_state.challan_type == "OTHER":
-                    st.session_state.other_form_key += 1
-                st.session_state.consumer_key += 1
+                    st.session_state.locked = True
+                    st.session_state.challan_type = challan_type
+                    st.session_state.start_no = int(s_challan)
+                    st.session_state.formatted_pdate = s_pdate.strftime("%d.%m.%Y")
+                    st.session_state.batch_id = batch_id
+                    journal.open_batch(
+                        batch_id, operator_id, challan_type, st.session_state.start_no, st.session_state.formatted_pdate
+                    )
+                    st.query_params["batch"] = batch_id
+                    st.rerun()
+
+        resumable = journal.open_batches(operator_id) if operator_id else []
+        if resumable:
+            resume_choice = st.selectbox("Unfinished Batches", resumable, format_func=resume_label)
+            if st.button("Resume Batch"):
+                restore_batch(resume_choice["batch_id"])
                 st.rerun()
+    else:
+        if st.button("Reset Session"):
+            st.session_state.locked = False
+            st.session_state.all_receipts = []
+            st.session_state.instrument_index = BatchInstrumentIndex()
+            st.session_state.temp_instruments = []
+            st.session_state.selected_bank = ""
+            st.session_state.other_form_key = 0
+            st.session_state.batch_purpose = ""
+            st.session_state.render_job_id = ""
+            # Abandoned batches stay in the journal and can still be resumed.
+            journal.set_status(st.session_state.batch_id, "abandoned")
+            allocator.release(st.session_state.batch_id)
+            st.session_state.batch_id = ""
+            st.session_state.allocation_error = ""
+            st.query_params.pop("batch", None)
+            st.rerun()
+
+    if perf.PERF_ENABLED:
+        # Figures cover everything timed up to the previous run.
+        with st.expander("Performance"):
+            st.caption("This session")
+            st.dataframe(st.session_state.perf.summary(), hide_index=True)
+            st.caption("This process")
+            st.dataframe(perf.process_timings.summary(), hide_index=True)
+            if perf.perf_log is not None and perf.perf_log.last_error:
+                st.warning(f"Timing log unavailable: {perf.perf_log.last_error}")
+
+if st.session_state.locked:
+    curr_count = len(st.session_state.all_receipts)
+    next_no = st.session_state.start_no + curr_count
+
+    if st.session_state.challan_type == "C. C":
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("First Challan", st.session_state.start_no)
+        m2.metric("Current No.", next_no)
+        m3.metric("Date", st.session_state.formatted_pdate)
+        m4.metric("Entered", curr_count)
+    else:
+        m1, m2 = st.columns(2)
+        m1.metric("Current No.", next_no)
+        m2.metric("Date", st.session_state.formatted_pdate)
+
+    if data_file is None:
+        st.info("Upload Master Data to continue this batch.")
+        st.stop()
+
+    db_error = journal.last_error or allocator.last_error or history.last_error
+    if db_error:
+        st.sidebar.warning(f"Batch journal unavailable: {db_error}")
+    if st.session_state.allocation_error:
+        st.error(f"{st.session_state.allocation_error} Finalize or reset this batch before adding to it.")
+
+    try:
+        master, master_source = load_master_data(data_file)
+    except MasterDataError as exc:
+        st.error(str(exc))
+        st.stop()
+    except Exception as exc:
+        st.error(f"Could not read Master Data: {exc}")
+        st.stop()
+    if master_source == "workbook":
+        st.sidebar.caption("Master data: cold parse of workbook")
+    else:
+        st.sidebar.caption(f"Master data: warm load ({master_source} cache)")
+
+    if master.duplicate_consumers:
+        dup_list = ", ".join(sorted(master.duplicate_consumers))
+        st.warning(f"Duplicate Consumer Numbers in Master Data: {dup_list}")
+
+    if len(master.validation):
+        with st.expander(f"Master data checks: {len(master.validation)} issue(s) found"):
+            st.dataframe(master.validation.summary(), hide_index=True)
+            st.download_button(
+                "Download Validation Report",
+                data=master.validation.to_csv,
+                file_name="master_data_report.csv",
+                mime="text/csv",
+            )
+
+    st.divider()
+
+    # None marks a full run: payment_panel is drawn right after the search
+    # panel, so the search panel must not force another rerun.
+    st.session_state.payment_ready = None
+    consumer_search_panel(master)
+    payment_panel()
 
     if st.session_state.all_receipts:
         st.divider()
-        if st.checkbox("👁️ View Batch Table", value=st.session_state.show_batch):
-            st.session_state.show_batch = True
-            t_head = st.columns([0.7, 2.2, 1.7, 1.2, 1.2, 2, 1.1])
-            t_head[0].write("**No.**")
-            t_head[1].write("**Consumer**")
-            t_head[2].write("**Amount**")
-            t_head[3].write("**Mode**")
-            t_head[4].write("**No.**")
-            t_head[5].write("**Purpose**")
-            t_head[6].write("**Actions**")
-            for i, rec in enumerate(st.session_state.all_receipts):
-                tcol = st.columns([0.7, 2.2, 1.7, 1.2, 1.2, 2, 1.1])
-                tcol[0].write(rec["challan"])
-                tcol[1].write(rec["name"])
-                tcol[2].write(f"₹{rec['amount']}")
-                tcol[3].write(rec["pay_type"])
-                tcol[4].write(rec["pay_no"])
-                tcol[5].write(rec.get("purpose", "C. C"))
-                with tcol[6]:
-                    s1, s2 = st.columns(2)
-                    if s1.button("✏️", key=f"e_{rec['id']}"):
-                        edit_amount_dialog(i)
-                    if s2.button("🗑️", key=f"d_{rec['id']}"):
-                        st.session_state.all_receipts.pop(i)
-                        for j in range(i, len(st.session_state.all_receipts)):
-                            st.session_state.all_receipts[j]["challan"] -= 1
-                        if not st.session_state.all_receipts:
-                            st.session_state.batch_purpose = ""
-                            st.session_state.other_form_key += 1
-                        st.rerun()
+        batch_table()
+
+        out_c1, out_c2 = st.columns(2)
+        with out_c1:
+            output_mode = st.radio("Output", ["Single Word File", "ZIP of Word Files"], horizontal=True)
+        with out_c2:
+            chunk_size = st.number_input("Receipts per Chunk", min_value=1, value=DEFAULT_CHUNK_SIZE, step=10)
+
+        tpl = template_for_batch(st.session_state.challan_type, st.session_state.all_receipts)
+        tpl_entry = templates.get(tpl)
+        batch_key = render_jobs.batch_fingerprint(
+            st.session_state.all_receipts,
+            tpl,
+            tpl_entry.digest if tpl_entry else "",
+            output_mode,
+            chunk_size,
+        )
 
         if st.button("🚀 Finalize Word File", type="primary"):
-            if st.session_state.challan_type == "C. C":
-                with open(CC_ADVANCE_TEMPLATE, "rb") as f:
-                    doc = DocxTemplate(io.BytesIO(f.read()))
+            if tpl_entry is None:
+                st.error(f"Template missing: {tpl}")
+                st.stop()
+
+            receipts = [dict(r) for r in st.session_state.all_receipts]
+            if output_mode == "ZIP of Word Files":
+                job = render_jobs.submit(
+                    batch_key, len(receipts), f"Challans_{date.today()}.zip",
+                    render_docx_shards, tpl, receipts, chunk_size, parallel=None,
+                )
             else:
-                first_selected_purpose = st.session_state.all_receipts[0].get("selected_purpose", "")
-                tpl = CC_ADVANCE_TEMPLATE if first_selected_purpose == "Advance Payment" else SD_TEMPLATE
-                if not os.path.exists(tpl):
-                    st.error(f"Template missing: {tpl}")
-                    st.stop()
-                with open(tpl, "rb") as f:
-                    doc = DocxTemplate(io.BytesIO(f.read()))
-
-            safe_receipts = [SafeReceipt(r) for r in st.session_state.all_receipts]
-            doc.render({"receipts": safe_receipts})
-            output = io.BytesIO()
-            doc.save(output)
-            output.seek(0)
-            st.download_button(
-                "📥 Download",
-                output.getvalue(),
-                file_name=f"Challans_{date.today()}.docx",
-            )
+                job = render_jobs.submit(
+                    batch_key, len(receipts), f"Challans_{date.today()}.docx",
+                    render_docx, tpl, receipts, chunk_size, parallel=None,
+                )
+            st.session_state.render_job_id = job.id
+
+        job = render_jobs.get_job(st.session_state.render_job_id)
+        if job is not None and job.key == batch_key:
+            if job.running:
+                render_job_progress(job.id)
+            elif job.status == "error":
+                st.error(f"Word file generation failed: {job.error}")
+            else:
+                st.download_button(
+                    "📥 Download",
+                    job.result,
+                    file_name=job.file_name,
+                    on_click=mark_batch_finalized,
+                )
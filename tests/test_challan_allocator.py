@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from challan_allocator import STALE_RESERVATION_SECONDS, AllocationError, ChallanAllocator
+
+
+@pytest.fixture
+def allocator(tmp_path):
+    return ChallanAllocator(path=str(tmp_path / "journal.sqlite3"), block=25)
+
+
+def test_finalize_then_reserve_again_keeps_only_issued_numbers(allocator):
+    allocator.reserve("b1", "C. C", 100)
+    allocator.ensure("b1", "C. C", 100, 109)
+    allocator.finalize("b1", 10)
+
+    # A page reload reserves the finalized batch again.
+    allocator.reserve("b1", "C. C", 100, 10)
+    row = allocator._connection().execute(
+        "SELECT first_no, last_no, issued_to FROM challan_ranges WHERE holder = 'b1'"
+    ).fetchone()
+    assert row == (100, 109, 109)
+
+    allocator.reserve("b2", "C. C", 110)
+    assert allocator.last_error == ""
+
+
+def test_issued_numbers_block_other_batches(allocator):
+    allocator.reserve("b1", "C. C", 100)
+    allocator.finalize("b1", 10)
+
+    with pytest.raises(AllocationError, match="100-109 are already issued"):
+        allocator.reserve("b2", "C. C", 90)
+
+
+def test_stale_tail_past_issued_to_no_longer_blocks(allocator):
+    allocator.reserve("b1", "C. C", 100)
+    allocator.finalize("b1", 10)
+    # A row widened past issued_to before finalized rows were protected.
+    allocator._connection().execute(
+        "UPDATE challan_ranges SET last_no = 134, updated_at = ? WHERE holder = 'b1'",
+        (time.time(),),
+    )
+    with pytest.raises(AllocationError, match="110-134 are reserved by another batch"):
+        allocator.reserve("b2", "C. C", 110)
+
+    allocator._connection().execute(
+        "UPDATE challan_ranges SET updated_at = ? WHERE holder = 'b1'",
+        (time.time() - STALE_RESERVATION_SECONDS - 1,),
+    )
+    allocator.reserve("b2", "C. C", 110)
+    assert allocator.last_error == ""
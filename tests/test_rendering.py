@@ -0,0 +1,56 @@
+import io
+import os
+import zipfile
+
+import pytest
+from docxtpl import DocxTemplate
+
+import rendering
+from receipts import build_receipt, sd_msd_breakdown
+from template_registry import CC_ADVANCE_TEMPLATE, SD_TEMPLATE, registry as templates
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def in_repo(monkeypatch):
+    # Templates are looked up relative to the app directory.
+    monkeypatch.chdir(REPO_DIR)
+    rendering.clear_fragment_cache()
+
+
+def make_receipts(template_path, count=12):
+    receipts = []
+    for i in range(count):
+        row = {"Name": f"CONSUMER {i} TRADERS", "Consumer Number": f"{i + 1:03d}"}
+        instruments = [{"bank": "State Bank of India", "type": "Cheque", "no": f"{100000 + i}", "date": "01.02.2025"}]
+        fields = {"purpose": "C. C. Charges", "description": "January - 2025", "month": "January - 2025"}
+        if template_path == SD_TEMPLATE:
+            fields.update(tag="SD", account="8336", breakdown=sd_msd_breakdown(1000 + i, 2000))
+        receipts.append(build_receipt(100 + i, "01.02.2025", row, instruments, "State Bank of India", 5000 + i, **fields))
+    receipts[1]["name"] = "A & B Traders <Unit 2>"
+    receipts[2]["bank"] = ""
+    receipts[3]["breakdown"] = "\n\nS.D\n"
+    for key, value in receipts[4].items():
+        if isinstance(value, str):
+            receipts[4][key] = ""
+    return receipts
+
+
+def package_parts(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+@pytest.mark.parametrize("template_path", [CC_ADVANCE_TEMPLATE, SD_TEMPLATE])
+def test_stitched_output_matches_docxtpl_render(template_path):
+    assert templates.get(template_path).shell() is not None
+    receipts = make_receipts(template_path)
+
+    doc = DocxTemplate(template_path)
+    doc.render({"receipts": [rendering.template_receipt(r) for r in receipts]})
+    output = io.BytesIO()
+    doc.save(output)
+
+    stitched = rendering.render_docx(template_path, receipts)
+    assert package_parts(stitched) == package_parts(output.getvalue())